@@ -0,0 +1,523 @@
+"""
+Benchmarks for the hot paths of the attendance system, written as JSON so runs can be compared.
+
+    python benchmark.py --sizes 100 1000 --output results.json
+    python benchmark.py --compare baseline.json results.json
+
+Each run builds (or reuses) synthetic galleries of `size` students x `crops` crops in the
+photos/<name>/<name>_<n>.jpg layout that capture_face used to write, imports them into the
+packed gallery, and measures:
+
+- training time and peak memory (train_from_gallery);
+- per-face predict latency, two-stage and exhaustive, and top-1 accuracy;
+- detectMultiScale FPS, legacy full-frame call versus FaceDetector;
+- end-to-end FPS of the threaded attendance loop on replayed frames;
+- mark_attendance latency through the AttendanceWriter, and the old commit-per-mark path;
+- GUI cold start: time to the first drawn window and to the loaded model, checked against
+  --startup-target (needs a display).
+
+Frames come from a recorded video (--video) or are synthesized from the gallery's faces, and are
+replayed through FrameReplay in place of cv2.VideoCapture(0).
+
+The 5000-student gallery from the original request needs roughly 12 GB of disk for the crops
+and 20 GB of RAM for the histograms, so it is not in the default sizes.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import mainnn as app
+
+SESSION_CLASSES = 20    # bench_predict: students split into this many attendance sessions
+
+
+# Synthetic faces: drawn so the Haar cascade detects them, with a per-student shape and skin
+# texture that LBPH can tell apart, and per-crop pose, lighting and noise variation
+def synthetic_face(student, variation_rng, pose=0, size=app.FACE_SIZE):
+    identity = np.random.default_rng(student)
+    p = identity.uniform(-1, 1, size=8)
+    skin = int(165 + 30 * p[0])
+    face = np.full((size, size), 60, dtype=np.uint8)
+    c = size // 2
+    cv2.ellipse(face, (c, c + 5), (int(size * 0.36 + 6 * p[1]), int(size * 0.46)), 0, 0, 360, skin, -1)
+    eye_y, eye_x = int(size * 0.40 + 6 * p[2]), int(size * 0.17 + 5 * p[3])
+    for side in (-1, 1):
+        cv2.ellipse(face, (c + side * eye_x, eye_y), (int(size * 0.09), int(size * 0.05)), 0, 0, 360, skin - 110, -1)
+        cv2.line(face, (c + side * eye_x - 20, eye_y - 22 + int(4 * p[4])), (c + side * eye_x + 20, eye_y - 24),
+                 skin - 120, 6)
+    cv2.ellipse(face, (c, int(size * 0.72 + 5 * p[5])), (int(size * 0.14 + 8 * p[6]), int(size * 0.04)),
+                0, 0, 360, skin - 100, -1)
+    cv2.line(face, (c, eye_y + 5), (c + int(6 * p[7]), int(size * 0.6)), skin - 40, 4)
+    texture = cv2.GaussianBlur(identity.normal(0, 40, (size, size)).astype(np.float32), (0, 0), 3)
+    face = face + texture
+
+    # Pose: a turn/tilt per capture variation, then small random jitter
+    angle = (pose % 4 - 1.5) * 3 + variation_rng.uniform(-3, 3)
+    scale = 1 + (pose // 4 - 1) * 0.03 + variation_rng.uniform(-0.03, 0.03)
+    matrix = cv2.getRotationMatrix2D((c, c), angle, scale)
+    matrix[:, 2] += variation_rng.uniform(-4, 4, size=2)
+    face = cv2.warpAffine(face, matrix, (size, size), borderMode=cv2.BORDER_REPLICATE)
+    face = face * variation_rng.uniform(0.85, 1.15) + variation_rng.normal(0, 4, face.shape)
+    return np.clip(face, 0, 255).astype(np.uint8)
+
+def capture_crop(cascade, face, face_px=160):
+    """
+    The crop capture_face would store: the face at face_px on a plain background, cut out at the
+    Haar box and resized to FACE_SIZE, so gallery and live crops are framed the same way.
+    """
+    canvas = np.full((2 * face_px, 2 * face_px), 80, dtype=np.uint8)
+    canvas[face_px // 2:face_px // 2 + face_px, face_px // 2:face_px // 2 + face_px] = \
+        cv2.resize(face, (face_px, face_px), interpolation=cv2.INTER_AREA)
+    boxes = cascade.detectMultiScale(canvas, 1.3, 5)
+    if not len(boxes):
+        return cv2.resize(face, (app.FACE_SIZE, app.FACE_SIZE))
+    x, y, w, h = max(boxes, key=lambda box: box[2] * box[3])
+    return cv2.resize(canvas[y:y + h, x:x + w], (app.FACE_SIZE, app.FACE_SIZE))
+
+def student_name(student):
+    return f"student_{student:05d}"
+
+def generate_gallery(photos_dir, students, crops, seed=0):
+    """Write students x crops JPEGs as photos/<name>/<name>_<n>.jpg; existing complete folders are kept."""
+    rng = np.random.default_rng(seed)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    for student in range(students):
+        name = student_name(student)
+        folder = os.path.join(photos_dir, name)
+        if os.path.isdir(folder) and len(os.listdir(folder)) == crops:
+            continue
+        os.makedirs(folder, exist_ok=True)
+        for n in range(1, crops + 1):
+            pose = (n - 1) % app.SESSION_SAMPLES // app.SAMPLES_PER_POSE
+            cv2.imwrite(os.path.join(folder, f"{name}_{n}.jpg"), capture_crop(cascade, synthetic_face(student, rng, pose)))
+
+def synthetic_frames(count, students, faces_per_frame=3, width=1280, height=720, face_px=160, seed=1):
+    """Frames of faces_per_frame enrolled students drifting across a noisy background."""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(40, 120, (height, width), dtype=np.uint8), (0, 0), 5)
+    who = rng.choice(students, size=faces_per_frame, replace=students < faces_per_frame)
+    faces = [cv2.resize(synthetic_face(int(student), rng), (face_px, face_px)) for student in who]
+    starts = rng.uniform([0, 0], [width - face_px, height - face_px], size=(faces_per_frame, 2))
+    velocity = rng.uniform(-4, 4, size=(faces_per_frame, 2))
+    frames = []
+    for index in range(count):
+        gray = background.copy()
+        for face, start, step in zip(faces, starts, velocity):
+            x, y = np.abs((start + step * index) % (2 * np.array([width - face_px, height - face_px])))
+            x = int(x if x <= width - face_px else 2 * (width - face_px) - x)
+            y = int(y if y <= height - face_px else 2 * (height - face_px) - y)
+            gray[y:y + face_px, x:x + face_px] = face
+        frames.append(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+    return frames, [student_name(int(student)) for student in who]
+
+def recorded_frames(source, count):
+    capture = app.open_source(source)
+    frames = []
+    while len(frames) < count:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+class FrameReplay:
+    """
+    Stands in for cv2.VideoCapture: serves pre-decoded frames, looping, either as fast as they
+    are read (fps=0) or paced like a camera.
+    """
+
+    def __init__(self, frames, fps=0, loop=True):
+        self.frames = frames
+        self.fps = fps
+        self.loop = loop
+        self.index = 0
+        self.started = None
+
+    def isOpened(self):
+        return bool(self.frames)
+
+    def grab(self):
+        if self.index >= len(self.frames) and not self.loop:
+            return False
+        if self.fps:
+            if self.started is None:
+                self.started = time.perf_counter()
+            delay = self.started + self.index / self.fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        return True, self.frames[(self.index - 1) % len(self.frames)]
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return 1000.0 * self.index / (self.fps or 30)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {'mean_ms': float(samples.mean()), 'p50_ms': float(np.percentile(samples, 50)),
+            'p95_ms': float(np.percentile(samples, 95)), 'max_ms': float(samples.max())}
+
+def bench_train(gallery):
+    tracemalloc.start()
+    started = time.perf_counter()
+    recognizer = app.train_from_gallery(gallery)
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return recognizer, {'seconds': seconds, 'peak_mb': peak / 2**20, 'samples': recognizer.count,
+                        'students': recognizer.student_count(), 'crops_per_second': recognizer.count / seconds}
+
+def bench_predict(recognizer, gallery, queries, exhaustive_queries, seed=2):
+    """Held-out style queries: fresh synthetic crops of enrolled students."""
+    rng = np.random.default_rng(seed)
+    students = sorted(gallery.label_map)
+    picks = rng.choice(len(students), size=queries)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = np.array([capture_crop(cascade, synthetic_face(int(students[i].rsplit('_', 1)[1]), rng, int(rng.integers(12))))
+                      for i in picks])
+    truth = np.array([gallery.label_map[students[i]] for i in picks])
+
+    results = {}
+    for mode, top_k, n in (('two_stage', app.SEARCH_TOP_K, queries), ('exhaustive', 0, exhaustive_queries)):
+        recognizer.top_k = top_k
+        latencies, labels = [], []
+        for face in faces[:n]:
+            started = time.perf_counter()
+            label, _ = recognizer.predict(face)
+            latencies.append(1000 * (time.perf_counter() - started))
+            labels.append(label)
+        results[mode] = dict(percentiles(latencies), accuracy=float(np.mean(np.array(labels) == truth[:n])),
+                             queries=n)
+
+    # A frame's worth of faces in one call
+    recognizer.top_k = app.SEARCH_TOP_K
+    started = time.perf_counter()
+    for start in range(0, queries, 8):
+        recognizer.predict_batch(faces[start:start + 8])
+    results['batch_of_8_per_face_ms'] = 1000 * (time.perf_counter() - started) / queries
+
+    # Attendance sessions: each query searched in the shard of its own class first
+    labels = np.unique(recognizer.labels)
+    shards = [app.RecognizerShard(labels[labels % SESSION_CLASSES == c]) for c in range(SESSION_CLASSES)]
+    for shard in shards:
+        shard.sync(recognizer)
+    latencies, predicted = [], []
+    for face, label in zip(faces, truth):
+        started = time.perf_counter()
+        found, _ = recognizer.predict_batch(face[None], shard=shards[label % SESSION_CLASSES])
+        latencies.append(1000 * (time.perf_counter() - started))
+        predicted.append(found[0])
+    results['session_shard'] = dict(percentiles(latencies), accuracy=float(np.mean(np.array(predicted) == truth)),
+                                    classes=SESSION_CLASSES, queries=queries)
+    return results
+
+def bench_detect(frames):
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+    results = {'frames': len(grays), 'resolution': f"{grays[0].shape[1]}x{grays[0].shape[0]}"}
+    for label, detector in (('legacy', app.FaceDetector.legacy(cascade)), ('face_detector', app.FaceDetector(cascade))):
+        found = sum(len(detector.detect(gray)) for gray in grays)
+        results[label] = {'fps': detector.fps(), 'faces_per_frame': found / len(grays)}
+    return results
+
+def bench_pipeline(recognizer, id_map, frames, seconds, camera_fps, expected_names):
+    """The run_attendance loop without the window: threaded stages, results polled by the caller."""
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    metrics = app.StageMetrics()
+    engine = app.AttendanceEngine(cascade, recognizer, id_map, metrics=metrics)
+    tracker = app.FaceTracker()
+    detector = app.FaceDetector(cascade, metrics=metrics)
+    scheduler = app.FrameScheduler(detector, tracker, engine, app.TARGET_FPS, metrics=metrics)
+    capture = FrameReplay(frames, fps=camera_fps)
+    pipeline = app.AttendancePipeline(capture, detector.detect,
+                                      lambda gray, faces, now: engine.recognize_faces(tracker, gray, faces, now),
+                                      metrics=metrics, scheduler=scheduler)
+    displayed = 0
+    confirmed = {}
+    started = time.perf_counter()
+    pipeline.start()
+    while time.perf_counter() - started < seconds:
+        if pipeline.results.get(timeout=0.02) is not None:
+            displayed += 1
+            metrics.tick()
+        while not pipeline.events.empty():
+            confirmed.setdefault(pipeline.events.get_nowait(), time.perf_counter() - started)
+    elapsed = time.perf_counter() - started
+    pipeline.stop()
+    return {
+        'duration': elapsed,
+        'camera_fps': camera_fps,
+        'frames_grabbed': capture.index,
+        'frames_displayed': displayed,
+        'fps': displayed / elapsed,
+        'detect_fps': detector.fps(),
+        'dropped_before_detect': pipeline.frames.dropped,
+        'dropped_before_recognize': pipeline.detections.dropped,
+        'scheduler_level': scheduler.level,
+        'confirmed': len(confirmed),
+        'confirmed_expected': len(set(confirmed) & set(expected_names)),
+        'seconds_to_first_confirmation': min(confirmed.values()) if confirmed else None,
+        'stages': {stage: {'p50_ms': stats['p50'] * 1000, 'p95_ms': stats['p95'] * 1000}
+                   for stage, stats in metrics.snapshot().items()}
+    }
+
+def bench_startup(database_dir, runs, target):
+    """
+    Cold start as the user sees it: from launching mainnn.py to its main window being drawn,
+    and to the saved model being loaded in the background. The median of `runs` launches
+    after one warm-up launch (which also creates the schema). Returns None without a display.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mainnn.py')
+    window, ready = [], []
+    for run in range(runs + 1):
+        started = time.perf_counter()
+        child = subprocess.Popen([sys.executable, script, '--database', database_dir, '--startup-report'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        marks = {}
+        for line in child.stdout:
+            marks[line.strip()] = time.perf_counter() - started
+        error = child.stderr.read().strip()
+        child.wait()
+        if 'window' not in marks or 'ready' not in marks:
+            print(f"  startup benchmark skipped: {error.splitlines()[-1] if error else 'no window'}")
+            return None
+        if run:
+            window.append(marks['window'])
+            ready.append(marks['ready'])
+    first_window = float(np.median(window))
+    return {'first_window_seconds': first_window, 'ready_seconds': float(np.median(ready)),
+            'target': target, 'within_target': first_window <= target}
+
+def bench_mark(workdir, marks):
+    """Latency seen by the Tk thread per mark, with the writer thread and with commit-per-mark."""
+    database_dir = os.path.join(workdir, "mark_db")
+    shutil.rmtree(database_dir, ignore_errors=True)
+    os.makedirs(database_dir)
+    conn = app.open_database(database_dir)
+    conn.executemany("INSERT INTO students (name, roll_number, faculty, year) VALUES (?, ?, ?, ?)",
+                     [(student_name(i), str(i), app.FACULTIES[i % 5], 1 + i % 4) for i in range(marks)])
+    conn.commit()
+    ids = [row[0] for row in conn.execute("SELECT id FROM students ORDER BY id")]
+
+    # Old path: insert and commit on the calling thread, with SQLite's default rollback journal
+    legacy_path = os.path.join(database_dir, "legacy.db")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    shutil.copy(os.path.join(database_dir, "attendance_system.db"), legacy_path)
+    legacy = sqlite3.connect(legacy_path)
+    legacy.execute("PRAGMA journal_mode = DELETE")
+    cursor = legacy.cursor()
+    synchronous = []
+    for student_id in ids:
+        started = time.perf_counter()
+        app.insert_attendance(cursor, student_id, datetime(2000, 1, 1, 9))
+        legacy.commit()
+        synchronous.append(1000 * (time.perf_counter() - started))
+    legacy.close()
+
+    writer = app.AttendanceWriter(database_dir)
+    submit = []
+    started_all = time.perf_counter()
+    for student_id in ids:
+        started = time.perf_counter()
+        writer.submit(student_id, datetime(2000, 1, 2, 9))
+        submit.append(1000 * (time.perf_counter() - started))
+    writer.flush()
+    drained_ms = 1000 * (time.perf_counter() - started_all)
+    writer.close()
+    conn.close()
+    return {
+        'marks': marks,
+        'commit_per_mark': percentiles(synchronous),
+        'writer_submit': percentiles(submit),
+        'writer_all_committed_ms': drained_ms,
+        'writer_commits': writer.commits
+    }
+
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {'galleries': {}}
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+
+    for size in args.sizes:
+        print(f"Gallery of {size} students x {args.crops} crops")
+        root = os.path.join(args.workdir, f"gallery_{size}x{args.crops}")
+        photos_dir = os.path.join(root, "photos")
+        started = time.perf_counter()
+        generate_gallery(photos_dir, size, args.crops)
+        generate_seconds = time.perf_counter() - started
+
+        shutil.rmtree(os.path.join(root, "gallery"), ignore_errors=True)
+        gallery = app.GalleryStore(os.path.join(root, "gallery"))
+        started = time.perf_counter()
+        gallery.import_photos(photos_dir)
+        import_seconds = time.perf_counter() - started
+
+        recognizer, train = bench_train(gallery)
+        print(f"  trained on {train['samples']} crops in {train['seconds']:.1f}s, peak {train['peak_mb']:.0f} MB")
+        predict = bench_predict(recognizer, gallery, args.queries, args.exhaustive_queries)
+        print(f"  predict p50 {predict['two_stage']['p50_ms']:.2f} ms two-stage, "
+              f"{predict['exhaustive']['p50_ms']:.2f} ms exhaustive")
+
+        if args.video:
+            frames, expected = recorded_frames(args.video, args.frames), []
+        else:
+            frames, expected = synthetic_frames(args.frames, size)
+        pipeline = bench_pipeline(recognizer, dict(gallery.id_map), frames, args.seconds, args.camera_fps, expected)
+        print(f"  attendance loop {pipeline['fps']:.1f} FPS, {pipeline['confirmed']} confirmed")
+        
+        # A database directory around this gallery with the model saved, as after a clean shutdown
+        startup_dir = os.path.join(root, "startup")
+        os.makedirs(startup_dir, exist_ok=True)
+        if not os.path.exists(os.path.join(startup_dir, "gallery")):
+            os.symlink(os.path.abspath(os.path.join(root, "gallery")), os.path.join(startup_dir, "gallery"))
+        app.save_model(recognizer, os.path.join(startup_dir, "lbph_model"),
+                       os.path.join(startup_dir, "model_manifest.json"), gallery.signature())
+        startup = bench_startup(startup_dir, args.startup_runs, args.startup_target)
+        if startup:
+            print(f"  first window after {startup['first_window_seconds']:.2f}s "
+                  f"(target {args.startup_target:.2f}s), model ready after {startup['ready_seconds']:.2f}s")
+
+        results['galleries'][str(size)] = {
+            'students': size, 'crops_per_student': args.crops,
+            'setup': {'generate': generate_seconds, 'import': import_seconds},
+            'train': train, 'predict': predict, 'pipeline': pipeline, 'startup': startup
+        }
+
+    frames = recorded_frames(args.video, args.frames) if args.video else synthetic_frames(args.frames, max(args.sizes))[0]
+    results['detect'] = bench_detect(frames)
+    print(f"Detection {results['detect']['legacy']['fps']:.1f} FPS legacy, "
+          f"{results['detect']['face_detector']['fps']:.1f} FPS FaceDetector")
+    results['mark'] = bench_mark(args.workdir, args.marks)
+    print(f"Marking p95 {results['mark']['commit_per_mark']['p95_ms']:.2f} ms commit-per-mark, "
+          f"{results['mark']['writer_submit']['p95_ms']:.3f} ms through the writer")
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'compare'}
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    
+    slow = [size for size, gallery in results['galleries'].items()
+            if gallery['startup'] and not gallery['startup']['within_target']]
+    if slow:
+        print(f"First window slower than {args.startup_target:.2f}s for gallery size(s) {', '.join(slow)}")
+    return len(slow)
+
+
+# Metric direction for --compare, by the last component of the metric's path
+LOWER_IS_BETTER = ('_ms', 'seconds', 'peak_mb')
+HIGHER_IS_BETTER = ('fps', 'accuracy', 'crops_per_second')
+
+def flatten(tree, prefix=''):
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+def compare(baseline_path, current_path, tolerance):
+    """Print metrics that moved by more than tolerance; returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = dict(flatten(json.load(f)['results']))
+    with open(current_path) as f:
+        current = dict(flatten(json.load(f)['results']))
+    regressions = 0
+    for path in sorted(set(baseline) & set(current)):
+        leaf = path.rsplit('.', 1)[-1]
+        if leaf.endswith(LOWER_IS_BETTER):
+            worse = 1
+        elif leaf.endswith(HIGHER_IS_BETTER):
+            worse = -1
+        else:
+            continue
+        old, new = baseline[path], current[path]
+        if not old:
+            continue
+        change = (new - old) / abs(old)
+        if abs(change) < tolerance:
+            continue
+        regressed = change * worse > 0
+        regressions += regressed
+        print(f"{'REGRESSION' if regressed else 'improved':>10}  {path}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+    print(f"{regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the attendance system's hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                        help="students per synthetic gallery (5000 needs ~20 GB of RAM)")
+    parser.add_argument('--crops', type=int, default=app.SESSION_SAMPLES, help="crops per student")
+    parser.add_argument('--workdir', default="./benchmark_data", help="where galleries and databases are generated")
+    parser.add_argument('--video', help="recorded video to replay instead of synthetic frames")
+    parser.add_argument('--frames', type=int, default=150, help="frames replayed in the detection and loop benchmarks")
+    parser.add_argument('--seconds', type=float, default=10, help="duration of the attendance loop benchmark")
+    parser.add_argument('--camera-fps', type=float, default=30,
+                        help="pace the replay like a camera; 0 replays as fast as possible, which starves the other stages")
+    parser.add_argument('--queries', type=int, default=200, help="faces for the predict benchmark")
+    parser.add_argument('--exhaustive-queries', type=int, default=20)
+    parser.add_argument('--marks', type=int, default=500, help="attendance marks for the commit benchmark")
+    parser.add_argument('--threads', type=int, default=0, help="OpenCV threads (0 = OpenCV default)")
+    parser.add_argument('--startup-runs', type=int, default=5, help="GUI launches timed per gallery")
+    parser.add_argument('--startup-target', type=float, default=1.0,
+                        help="seconds to the first drawn window; exceeding it makes the run exit 1")
+    parser.add_argument('--output', default=f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="compare two result files instead of running; exits 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="relative change reported by --compare")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.tolerance) else 0)
+    sys.exit(1 if run(args) else 0)
+
+if __name__ == "__main__":
+    main()
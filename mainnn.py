@@ -1,136 +1,3020 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import cv2
 import numpy as np
 from datetime import datetime, timedelta
-import pandas as pd
 import os
 import shutil 
 import sqlite3
-from tkcalendar import Calendar
+import json
+import csv
+import argparse
+import time
+import threading
+import queue
+from collections import deque, OrderedDict
+
+# pandas (reports, exports), tkcalendar (date picker), http.server (metrics endpoint), urllib
+# (file:// sources), multiprocessing and concurrent.futures (workers) are imported where they
+# are first used, so they do not delay the main window
+
+# Bump when the manifest layout changes so stale manifests force a retrain
+MANIFEST_VERSION = 4
+# Stored in the database's PRAGMA user_version; bump when create_schema() changes
+SCHEMA_VERSION = 2
+
+DATABASE_DIR = "./student_database"
+FACE_SIZE = 200           # every stored crop is FACE_SIZE x FACE_SIZE grayscale
+TRAIN_BATCH_SIZE = 512    # crops read from the gallery per LBPH train/update call
+SAMPLES_PER_POSE = 5      # samples captured for each pose variation
+SEARCH_TOP_K = 10         # students kept by the prototype prefilter; 0 = exhaustive search
+
+# Face tracking during attendance: each track is recognized on its first frame, then re-checked.
+# The rules are in seconds rather than frames, so they behave the same on fast and slow machines.
+TRACK_RECHECK_SECONDS = 0.2   # time between re-recognitions of the same track
+TRACK_REQUIRED_VOTES = 5      # agreeing recognitions before a track's attendance is marked
+TRACK_CONFIRM_SECONDS = 1.0   # and the time the track must have been followed
+TRACK_MIN_AGREEMENT = 0.7     # share of the track's recognitions that must agree on the name
+TRACK_MAX_MISSED_SECONDS = 1.0  # time a track survives without a matching detection
+RECOGNITION_THRESHOLD = 60  # LBPH confidence below which a match is accepted (lower = better)
+SHARD_ACCEPT_THRESHOLD = 30  # session-class matches at least this far are checked against everyone
+
+# Sample quality: registration crops failing these are not stored (see SampleQuality)
+QUALITY_MIN_SHARPNESS = 12            # variance of the Laplacian of a FACE_SIZE crop
+QUALITY_BRIGHTNESS_RANGE = (40, 215)  # acceptable mean grey level
+QUALITY_MIN_CONTRAST = 15             # grey level standard deviation
+QUALITY_MIN_FACE_SIZE = 80            # detected face width in pixels, before resizing to FACE_SIZE
+DUPLICATE_DISTANCE = 12               # chi-square distance below which two samples are near-duplicates
+
+# Attendance marks are committed by a writer thread in groups
+ATTENDANCE_BATCH_SIZE = 32  # marks per commit at most
+ATTENDANCE_FLUSH_MS = 200   # longest a mark waits for its group to fill
+ATTENDANCE_CACHE_DAYS = 31  # days of attendance kept in memory by AttendanceStore
+EXPORT_CHUNK_ROWS = 10000   # rows read from SQLite and written per export chunk
+TABLE_DRAIN_MS = 100        # interval at which live marks are moved into the attendance table
+METRICS_WINDOW = 500        # latest samples per stage kept for the rolling percentiles
+METRICS_REFRESH_MS = 1000   # interval at which the status panel and overlay figures are recomputed
+METRICS_EXPORT_MS = 5000    # interval at which --metrics-file is rewritten
+TRAIN_POLL_MS = 100         # interval at which background training progress is picked up
+
+# Face detection: downscaled search, region-of-interest tracking and expected face size
+DETECT_SCALE = 0.5              # detection runs on the frame resized by this factor
+DETECT_FULL_SCAN_FRAMES = 10    # full-frame scan interval; other frames search around known faces
+CAMERA_HFOV_DEGREES = 60        # horizontal field of view of a typical webcam
+SUBJECT_DISTANCE_RANGE = (0.4, 3.0)  # metres between the camera and the students
+FACE_WIDTH_METERS = 0.16
+
+# Adaptive frame scheduling: when frames cost more than 1 / TARGET_FPS, work is shed level by level
+TARGET_FPS = 15                 # attendance loop frame rate to hold; 0 disables the scheduler
+SCHEDULER_WINDOW = 15           # frames averaged between two adjustments
+SCHEDULER_CALM_WINDOWS = 4      # windows well under budget in a row before work is added back
+SCHEDULER_LEVELS = [
+    # (detect every n frames, detection scale, track recheck seconds, recognitions per frame)
+    (1, DETECT_SCALE, TRACK_RECHECK_SECONDS, None),
+    (1, 0.4, 0.3, 8),
+    (2, 0.4, 0.5, 4),
+    (2, 0.33, 0.75, 2),
+    (3, 0.33, 1.0, 1),
+]
+
+# Faculties and years with their own student and attendance tables
+FACULTIES = ['Civil', 'Computer', 'Mechanical', 'Electrical', 'Agriculture']
+YEARS = [1, 2, 3, 4]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Poses the student is guided through during capture_face; the index is stored as the sample's pose
+CAPTURE_VARIATIONS = [
+    {"prompt": "Look straight ahead", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Smile naturally", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Turn your head slightly to the left", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Turn your head slightly to the right", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Tilt you head slightly upward", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Tilt your head slightly downward", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Tilt your head slightly towards left", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Tilt your head slightly towards right", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Make eyes wide open", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Make eyes slightly squinted", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Move little close to your camera", "samples": SAMPLES_PER_POSE},
+    {"prompt": "Move little away from your camera", "samples": SAMPLES_PER_POSE}
+]
+SESSION_SAMPLES = sum(variation["samples"] for variation in CAPTURE_VARIATIONS)
+AUTO_CAPTURE_RATE = 4               # samples per second taken in hands-free capture
+AUTO_CAPTURE_PROMPT_SECONDS = 1.5   # time to get into each pose before hands-free capture starts
+
+
+class GalleryStore:
+    """
+    Packed, append-only store for all face crops.
+    
+    faces.u8   - every crop as raw uint8 pixels, back to back (memory-mapped for reading)
+    index.bin  - one fixed-size record per crop: label, pose and capture time
+    meta.json  - name <-> label mapping, next unused label and deleted (tombstoned) labels
+    
+    Deleting a person only tombstones their label; compact() rewrites the files without them.
+    """
+    
+    INDEX_DTYPE = np.dtype([('label', '<i4'), ('pose', '<i4'), ('captured', '<f8')])
+    
+    def __init__(self, gallery_dir, face_size=FACE_SIZE):
+        self.gallery_dir = gallery_dir
+        self.face_size = face_size
+        self.face_bytes = face_size * face_size
+        self.faces_path = os.path.join(gallery_dir, "faces.u8")
+        self.index_path = os.path.join(gallery_dir, "index.bin")
+        self.meta_path = os.path.join(gallery_dir, "meta.json")
+        os.makedirs(gallery_dir, exist_ok=True)
+        
+        self.label_map = {}   # name -> label
+        self.id_map = {}      # label -> name
+        self.next_label = 0
+        self.deleted = set()  # tombstoned labels still present in the packed files
+        self._faces = None
+        self._index = None
+        
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.label_map.update(meta['labels'])
+            self.next_label = meta['next_label']
+            self.deleted = set(meta['deleted'])
+        self.id_map.update({label: name for name, label in self.label_map.items()})
+        self.count = self._recover()
+    
+    def _recover(self):
+        """Drop a partially written trailing record left behind by an interrupted append."""
+        if not os.path.exists(self.faces_path):
+            return 0
+        count = min(os.path.getsize(self.faces_path) // self.face_bytes,
+                    os.path.getsize(self.index_path) // self.INDEX_DTYPE.itemsize
+                    if os.path.exists(self.index_path) else 0)
+        for path, size in ((self.faces_path, count * self.face_bytes),
+                           (self.index_path, count * self.INDEX_DTYPE.itemsize)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        return count
+    
+    def exists(self):
+        return os.path.exists(self.faces_path)
+    
+    def _save_meta(self):
+        meta = {
+            'face_size': self.face_size,
+            'labels': self.label_map,
+            'next_label': self.next_label,
+            'deleted': sorted(self.deleted)
+        }
+        tmp_meta = self.meta_path + '.tmp'
+        with open(tmp_meta, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, self.meta_path)
+    
+    def signature(self):
+        """Cheap fingerprint of the gallery contents, used to validate a persisted model."""
+        stat = os.stat(self.faces_path) if self.exists() else None
+        return {
+            'count': self.count,
+            'size': stat.st_size if stat else 0,
+            'mtime_ns': stat.st_mtime_ns if stat else 0,
+            'deleted': sorted(self.deleted)
+        }
+    
+    def label_for(self, name):
+        """Return the person's label, assigning the next unused one for a new name."""
+        if name not in self.label_map:
+            self.label_map[name] = self.next_label
+            self.id_map[self.next_label] = name
+            self.next_label += 1
+            self._save_meta()
+        return self.label_map[name]
+    
+    def append(self, name, faces, poses=None):
+        """Append crops for a person. faces is a sequence of FACE_SIZE x FACE_SIZE uint8 images."""
+        if len(faces) == 0:
+            return self.label_for(name)
+        label = self.label_for(name)
+        records = np.zeros(len(faces), dtype=self.INDEX_DTYPE)
+        records['label'] = label
+        records['pose'] = -1 if poses is None else poses
+        records['captured'] = datetime.now().timestamp()
+        
+        # Pixels first, then the index: a crash in between leaves a record _recover() drops
+        with open(self.faces_path, 'ab') as f:
+            for face in faces:
+                f.write(np.ascontiguousarray(face, dtype=np.uint8).tobytes())
+        with open(self.index_path, 'ab') as f:
+            f.write(records.tobytes())
+        self.count += len(faces)
+        self._faces = None
+        self._index = None
+        return label
+    
+    def faces(self):
+        """All stored crops as a read-only (N, FACE_SIZE, FACE_SIZE) memory map."""
+        if self._faces is None:
+            if self.count == 0:
+                self._faces = np.empty((0, self.face_size, self.face_size), dtype=np.uint8)
+            else:
+                self._faces = np.memmap(self.faces_path, dtype=np.uint8, mode='r',
+                                        shape=(self.count, self.face_size, self.face_size))
+        return self._faces
+    
+    def index(self):
+        if self._index is None:
+            if self.count == 0:
+                self._index = np.empty(0, dtype=self.INDEX_DTYPE)
+            else:
+                self._index = np.fromfile(self.index_path, dtype=self.INDEX_DTYPE, count=self.count)
+        return self._index
+    
+    def live_mask(self):
+        return ~np.isin(self.index()['label'], list(self.deleted))
+    
+    def snapshot(self):
+        """(faces, index, live mask) as stored now; later appends and deletions do not change it."""
+        return self.faces(), self.index(), self.live_mask()
+    
+    def iter_batches(self, batch_size=TRAIN_BATCH_SIZE, snapshot=None):
+        """
+        Yield (faces, labels, poses) for live records in file order. Each batch is one sequential
+        read of the memory map, so peak memory stays at batch_size crops regardless of gallery size.
+        snapshot (from snapshot()) pins the records to iterate, e.g. for another thread.
+        """
+        faces, index, live = snapshot or self.snapshot()
+        for start in range(0, len(index), batch_size):
+            end = min(start + batch_size, len(index))
+            keep = live[start:end]
+            if not keep.any():
+                continue
+            batch = np.array(faces[start:end])[keep]
+            yield batch, index['label'][start:end][keep], index['pose'][start:end][keep]
+    
+    def first_samples(self):
+        """name -> row of that person's first live crop, for reference thumbnails."""
+        labels = self.index()['label']
+        uniques, rows = np.unique(labels, return_index=True)
+        return {self.id_map[label]: row for label, row in zip(uniques.tolist(), rows.tolist())
+                if label not in self.deleted and label in self.id_map}
+    
+    def delete_person(self, name):
+        """Tombstone a person's crops; returns their label or None if unknown."""
+        label = self.label_map.pop(name, None)
+        if label is None:
+            return None
+        self.id_map.pop(label, None)
+        self.deleted.add(label)
+        self._save_meta()
+        return label
+    
+    def compact(self, keep=None):
+        """
+        Rewrite the packed files without tombstoned crops. keep, a boolean mask over the stored
+        records, drops individual crops as well.
+        """
+        if not self.deleted and keep is None:
+            return
+        tmp_faces = self.faces_path + '.tmp'
+        tmp_index = self.index_path + '.tmp'
+        kept = 0
+        with open(tmp_faces, 'wb') as ff, open(tmp_index, 'wb') as fi:
+            faces = self.faces()
+            index = self.index()
+            live = self.live_mask() if keep is None else self.live_mask() & keep
+            for start in range(0, self.count, TRAIN_BATCH_SIZE):
+                end = min(start + TRAIN_BATCH_SIZE, self.count)
+                batch_live = live[start:end]
+                ff.write(np.array(faces[start:end])[batch_live].tobytes())
+                fi.write(index[start:end][batch_live].tobytes())
+                kept += int(batch_live.sum())
+        
+        # Release the memory map before replacing the file it points at
+        self._faces = None
+        self._index = None
+        faces = None
+        os.replace(tmp_faces, self.faces_path)
+        os.replace(tmp_index, self.index_path)
+        self.count = kept
+        self.deleted.clear()
+        self._save_meta()
+    
+    def import_photos(self, photos_dir, progress=None):
+        """
+        Convert a legacy photos/<name>/<name>_<n>.jpg tree into the packed store. The pose is
+        recovered from the sample number written by capture_face (SAMPLES_PER_POSE per variation).
+        Returns (people, crops) imported.
+        """
+        people = 0
+        imported = 0
+        for person in sorted(os.listdir(photos_dir)):
+            folder_path = os.path.join(photos_dir, person)
+            if not os.path.isdir(folder_path):
+                continue
+            faces = []
+            poses = []
+            for filename in sorted(os.listdir(folder_path)):
+                if not filename.endswith('.jpg'):
+                    continue
+                img = cv2.imread(os.path.join(folder_path, filename), cv2.IMREAD_GRAYSCALE)
+                if img is None:
+                    continue
+                if img.shape != (self.face_size, self.face_size):
+                    img = cv2.resize(img, (self.face_size, self.face_size))
+                faces.append(img)
+                number = filename[:-4].rsplit('_', 1)[-1]
+                poses.append((int(number) - 1) % SESSION_SAMPLES // SAMPLES_PER_POSE if number.isdigit() else -1)
+                if len(faces) == TRAIN_BATCH_SIZE:
+                    self.append(person, faces, poses)
+                    imported += len(faces)
+                    faces, poses = [], []
+            if faces:
+                self.append(person, faces, poses)
+                imported += len(faces)
+            if person in self.label_map:
+                people += 1
+                if progress:
+                    progress(person, imported)
+        return people, imported
+
+class LBPHRecognizer:
+    """
+    NumPy implementation of OpenCV's LBPH face recognizer.
+    
+    Features are the same circular LBP codes and grid_x * grid_y spatial histograms that
+    cv2.face.LBPHFaceRecognizer computes, and distances are the same chi-square (ALT) metric,
+    so labels and confidences match the OpenCV recognizer. The difference is the layout:
+    every gallery histogram lives in one contiguous float32 matrix stored bin-major
+    (one row per histogram bin, one column per sample), and predict_batch() scores all
+    faces of a frame against the gallery in a single pass over it.
+    
+    With top_k > 0 the search is two-stage: the queries are first ranked against one
+    prototype (mean histogram) per student and pose using a Hellinger similarity, which is a
+    single matrix product, and the exact chi-square comparison then only runs over the
+    samples of the top_k closest students.
+    """
+    
+    EXTRACT_BATCH = 64          # crops converted to LBP codes at a time (bounds temporaries)
+    PROTOTYPE_BATCH = 4096      # samples folded into the prototypes per matrix product
+    CANDIDATE_ROWS = 4096       # largest candidate set scored with a single dense gather
+    DISTANCE_BLOCK = 1 << 20    # gathered bins x gallery columns per exhaustive-search block
+    COMPACT_BLOCK = 1 << 22     # matrix cells moved at a time when columns are removed
+    
+    def __init__(self, radius=1, neighbors=8, grid_x=8, grid_y=8, threshold=np.inf, top_k=0):
+        self.radius = radius
+        self.neighbors = neighbors
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.threshold = threshold
+        self.top_k = top_k      # candidate students for the exact stage; 0 searches everything
+        self.num_patterns = 1 << neighbors
+        self.dim = grid_x * grid_y * self.num_patterns
+        self._histograms = np.empty((self.dim, 0), dtype=np.float32)  # bins x capacity
+        self._labels = np.empty(0, dtype=np.int32)
+        self._mass = np.empty(0, dtype=np.float32)  # per-histogram sum, used by the distance identity
+        self._poses = np.empty(0, dtype=np.int32)
+        self.count = 0
+        self.version = 0        # bumped on every change, so RecognizerShards know to re-derive
+        
+        # Per (label, pose) prototypes, kept up to date incrementally as samples come and go
+        self._proto_index = {}                                      # (label, pose) -> column
+        self._proto_sums = np.empty((self.dim, 0), dtype=np.float32)
+        self._proto_counts = np.empty(0, dtype=np.float32)
+        self._proto_labels = np.empty(0, dtype=np.int32)
+        self._proto_sqrt = np.empty((self.dim, 0), dtype=np.float32) # sqrt of the mean histograms
+        self._proto_dirty = set()                                   # columns whose sqrt is stale
+        self._proto_groups = None                                   # (order, starts, labels) by student
+        self._label_rows = None                                     # (order, label -> slice) of samples
+        
+        # Sampling offsets and bilinear weights for each neighbour, as in OpenCV's elbp()
+        self._sampling = []
+        for n in range(neighbors):
+            x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+            y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+            fx, fy = int(np.floor(x)), int(np.floor(y))
+            cx, cy = int(np.ceil(x)), int(np.ceil(y))
+            tx, ty = np.float32(x - fx), np.float32(y - fy)
+            weights = ((1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty)
+            self._sampling.append((fx, fy, cx, cy, tuple(np.float32(w) for w in weights)))
+    
+    @property
+    def histograms(self):
+        """Gallery histograms as a (count, dim) view."""
+        return self._histograms[:, :self.count].T
+    
+    @property
+    def labels(self):
+        return self._labels[:self.count]
+    
+    @property
+    def poses(self):
+        return self._poses[:self.count]
+    
+    @property
+    def prototype_count(self):
+        return len(self._proto_index)
+    
+    def empty(self):
+        return self.count == 0
+    
+    def lbp_codes(self, faces):
+        """Circular LBP codes for a (B, H, W) uint8 batch; returns (B, H - 2r, W - 2r) int32."""
+        src = np.asarray(faces, dtype=np.float32)
+        r = self.radius
+        rows, cols = src.shape[1] - 2 * r, src.shape[2] - 2 * r
+        center = src[:, r:r + rows, r:r + cols]
+        codes = np.zeros(center.shape, dtype=np.int32)
+        eps = np.finfo(np.float32).eps
+        for n, (fx, fy, cx, cy, (w1, w2, w3, w4)) in enumerate(self._sampling):
+            t = (w1 * src[:, r + fy:r + fy + rows, r + fx:r + fx + cols]
+                 + w2 * src[:, r + fy:r + fy + rows, r + cx:r + cx + cols]
+                 + w3 * src[:, r + cy:r + cy + rows, r + fx:r + fx + cols]
+                 + w4 * src[:, r + cy:r + cy + rows, r + cx:r + cx + cols])
+            codes |= ((t > center) | (np.abs(t - center) < eps)).astype(np.int32) << n
+        return codes
+    
+    def extract(self, faces):
+        """Spatial LBP histograms for a batch of crops, shape (B, grid_x * grid_y * 2^neighbors)."""
+        faces = np.asarray(faces)
+        if faces.ndim == 2:
+            faces = faces[None]
+        out = np.empty((len(faces), self.dim), dtype=np.float32)
+        for start in range(0, len(faces), self.EXTRACT_BATCH):
+            codes = self.lbp_codes(faces[start:start + self.EXTRACT_BATCH])
+            batch = len(codes)
+            height = codes.shape[1] // self.grid_y
+            width = codes.shape[2] // self.grid_x
+            cells = codes[:, :height * self.grid_y, :width * self.grid_x]
+            cells = cells.reshape(batch, self.grid_y, height, self.grid_x, width).transpose(0, 1, 3, 2, 4)
+            cells = cells.reshape(batch, self.grid_y * self.grid_x, height * width)
+            
+            # One bincount for the whole batch: offset every code by its (face, cell) slot
+            slots = np.arange(batch * self.grid_y * self.grid_x, dtype=np.int64) * self.num_patterns
+            flat = (cells + slots.reshape(batch, -1, 1)).ravel()
+            hist = np.bincount(flat, minlength=len(slots) * self.num_patterns)
+            out[start:start + batch] = hist.reshape(batch, self.dim) / np.float32(height * width)
+        return out
+    
+    def _append(self, histograms, labels, poses):
+        needed = self.count + len(histograms)
+        if needed > self._histograms.shape[1]:
+            # Grow geometrically so repeated update() calls stay amortised O(new samples)
+            capacity = max(needed, 2 * self._histograms.shape[1], 64)
+            grown = np.empty((self.dim, capacity), dtype=np.float32)
+            grown[:, :self.count] = self._histograms[:, :self.count]
+            self._histograms = grown
+            self._labels = np.resize(self._labels, capacity)
+            self._mass = np.resize(self._mass, capacity)
+            self._poses = np.resize(self._poses, capacity)
+        self._histograms[:, self.count:needed] = histograms.T
+        self._labels[self.count:needed] = labels
+        self._mass[self.count:needed] = histograms.sum(axis=1)
+        self._poses[self.count:needed] = poses
+        self.count = needed
+        self.version += 1
+        self._label_rows = None
+        self._add_to_prototypes(histograms.T, labels, poses)
+    
+    def _prototype_column(self, key):
+        column = self._proto_index.get(key)
+        if column is None:
+            column = len(self._proto_index)
+            if column == self._proto_sums.shape[1]:
+                capacity = max(64, 2 * column)
+                for name in ('_proto_sums', '_proto_sqrt'):
+                    grown = np.zeros((self.dim, capacity), dtype=np.float32)
+                    grown[:, :column] = getattr(self, name)[:, :column]
+                    setattr(self, name, grown)
+                self._proto_counts = np.resize(self._proto_counts, capacity)
+                self._proto_labels = np.resize(self._proto_labels, capacity)
+            self._proto_sums[:, column] = 0
+            self._proto_counts[column] = 0
+            self._proto_labels[column] = key[0]
+            self._proto_index[key] = column
+            self._proto_groups = None
+        return column
+    
+    def _add_to_prototypes(self, columns, labels, poses):
+        """Fold a (dim, n) block of sample histograms into the per (label, pose) sums."""
+        for start in range(0, columns.shape[1], self.PROTOTYPE_BATCH):
+            end = start + self.PROTOTYPE_BATCH
+            keys = list(zip(np.asarray(labels[start:end]).tolist(), np.asarray(poses[start:end]).tolist()))
+            unique_keys = sorted(set(keys))
+            slot = {key: i for i, key in enumerate(unique_keys)}
+            assignment = np.zeros((len(keys), len(unique_keys)), dtype=np.float32)
+            assignment[np.arange(len(keys)), [slot[key] for key in keys]] = 1
+            
+            targets = [self._prototype_column(key) for key in unique_keys]
+            self._proto_sums[:, targets] += columns[:, start:end] @ assignment
+            self._proto_counts[targets] += assignment.sum(axis=0)
+            self._proto_dirty.update(targets)
+    
+    def _prototype_matrix(self):
+        """sqrt of every prototype's mean histogram, (dim, P); only stale columns are recomputed."""
+        if self._proto_dirty:
+            dirty = sorted(self._proto_dirty)
+            self._proto_sqrt[:, dirty] = np.sqrt(self._proto_sums[:, dirty] / self._proto_counts[dirty])
+            self._proto_dirty.clear()
+        return self._proto_sqrt[:, :len(self._proto_index)]
+    
+    def _student_groups(self):
+        """Prototype columns ordered by student, for a per-student reduce of the similarities."""
+        if self._proto_groups is None:
+            labels = self._proto_labels[:len(self._proto_index)]
+            order = np.argsort(labels, kind='stable')
+            sorted_labels = labels[order]
+            starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+            self._proto_groups = (order, starts, sorted_labels[starts])
+        return self._proto_groups
+    
+    def train(self, faces, labels, poses=None):
+        self.count = 0
+        self._proto_index.clear()
+        self._proto_dirty.clear()
+        self._proto_groups = None
+        self.update(faces, labels, poses)
+    
+    def update(self, faces, labels, poses=None):
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        poses = np.full(len(labels), -1, dtype=np.int32) if poses is None else np.asarray(poses, dtype=np.int32)
+        self._append(self.extract(faces), labels, poses)
+    
+    def remove_label(self, label):
+        """Drop every histogram and prototype of one label in place; returns the number removed."""
+        keep = self.labels != label
+        removed = self.count - int(keep.sum())
+        if removed:
+            kept = int(keep.sum())
+            self._compact_columns(self._histograms, keep)
+            self._labels[:kept] = self.labels[keep]
+            self._mass[:kept] = self._mass[:self.count][keep]
+            self._poses[:kept] = self.poses[keep]
+            self.count = kept
+            self.version += 1
+            self._label_rows = None
+            
+            # Compact the prototype columns the same way
+            total = len(self._proto_index)
+            keep_proto = self._proto_labels[:total] != label
+            kept_proto = int(keep_proto.sum())
+            for name in ('_proto_sums', '_proto_sqrt'):
+                self._compact_columns(getattr(self, name), keep_proto)
+            self._proto_counts[:kept_proto] = self._proto_counts[:total][keep_proto]
+            self._proto_labels[:kept_proto] = self._proto_labels[:total][keep_proto]
+            old_columns = np.flatnonzero(keep_proto)
+            new_column = {old: new for new, old in enumerate(old_columns.tolist())}
+            self._proto_index = {key: new_column[column] for key, column in self._proto_index.items()
+                                 if key[0] != label}
+            self._proto_dirty = {new_column[column] for column in self._proto_dirty if column in new_column}
+            self._proto_groups = None
+        return removed
+    
+    def _compact_columns(self, matrix, keep):
+        """
+        Move the columns of matrix selected by the boolean mask keep to the front, in order.
+        Only the columns after the first removed one move, a block at a time, so the temporary
+        stays at COMPACT_BLOCK cells instead of a copy of the whole matrix.
+        """
+        first = int(np.argmin(keep))
+        block_size = max(1, self.COMPACT_BLOCK // matrix.shape[0])
+        out = first
+        for start in range(first, len(keep), block_size):
+            end = min(start + block_size, len(keep))
+            selected = keep[start:end]
+            moved = int(selected.sum())
+            # Columns are only written at or before the block being read, never after it
+            matrix[:, out:out + moved] = matrix[:, start:end][:, selected]
+            out += moved
+    
+    def rows_for_labels(self, labels):
+        """Sample rows belonging to any of the given labels, via a cached sort by label."""
+        if self._label_rows is None:
+            order = np.argsort(self.labels, kind='stable')
+            sorted_labels = self.labels[order]
+            starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            spans = {label: (start, end) for label, start, end
+                     in zip(sorted_labels[starts].tolist(), starts.tolist(), ends.tolist())}
+            self._label_rows = (order, spans)
+        order, spans = self._label_rows
+        return np.sort(np.concatenate([order[slice(*spans[label])] for label in np.asarray(labels).tolist()
+                                       if label in spans] or [np.empty(0, dtype=np.intp)]))
+    
+    def student_count(self):
+        return len(self._student_groups()[2])
+    
+    def candidate_labels(self, queries, top_k, shard=None):
+        """
+        Stage one: the top_k students per query by Hellinger similarity to their best prototype.
+        Returns an (M, top_k) label array. A shard limits the ranking to its students.
+        """
+        prototypes = self._prototype_matrix()
+        if shard is None:
+            order, starts, student_labels = self._student_groups()
+        else:
+            prototypes = prototypes[:, shard.columns]
+            order, starts, student_labels = shard.groups
+        similarity = np.sqrt(queries) @ prototypes
+        per_student = np.maximum.reduceat(similarity[:, order], starts, axis=1)
+        top_k = min(top_k, len(student_labels))
+        best = np.argpartition(-per_student, top_k - 1, axis=1)[:, :top_k]
+        return student_labels[best]
+    
+    def distances(self, queries, rows=None):
+        """
+        Chi-square (ALT) distances between query histograms (M, dim) and the gallery, shape (M, N).
+        rows optionally restricts the gallery to a subset of samples.
+        
+        Uses 2 * sum((a - b)^2 / (a + b)) = 2 * (sum a + sum b - 4 * sum(a * b / (a + b))),
+        where the last sum only involves bins that are non-zero in both histograms. For each
+        query, its non-zero bins are gathered for a block of gallery columns at a time and the
+        block is reduced with one matrix product, as in candidate_distances().
+        """
+        queries = np.atleast_2d(queries)
+        if rows is None:
+            rows = slice(0, self.count)
+        mass = self._mass[rows]
+        columns = len(mass)
+        
+        shared = np.empty((len(queries), columns), dtype=np.float64)
+        for i, query in enumerate(queries):
+            used = np.flatnonzero(query)
+            q = query[used][:, None]
+            block_size = max(256, self.DISTANCE_BLOCK // max(1, len(used)))
+            for start in range(0, columns, block_size):
+                end = min(start + block_size, columns)
+                if isinstance(rows, slice):
+                    block = self._histograms[used, rows.start + start:rows.start + end]
+                else:
+                    block = self._histograms[np.ix_(used, rows[start:end])]
+                ratio = block + q
+                np.divide(block, ratio, out=ratio)
+                shared[i, start:end] = q.T.astype(np.float64) @ ratio
+        
+        result = 2 * (queries.sum(axis=1)[:, None] + mass[None, :] - 4 * shared)
+        return np.maximum(result, 0, out=result)
+    
+    def candidate_distances(self, query, rows):
+        """
+        Chi-square distances from one query histogram to a small sorted set of sample rows.
+        A student's samples are stored next to each other, so the rows form a few contiguous
+        runs; the query's non-zero bins are gathered for those runs in one block.
+        """
+        if len(rows) > self.CANDIDATE_ROWS:
+            return self.distances(query, rows)[0]
+        breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+        run_starts = rows[np.r_[0, breaks]]
+        run_ends = rows[np.r_[breaks - 1, len(rows) - 1]] + 1
+        used = np.flatnonzero(query)
+        q = query[used][:, None]
+        block = np.concatenate([self._histograms[used, start:end]
+                                for start, end in zip(run_starts.tolist(), run_ends.tolist())], axis=1)
+        shared = (block * q / (block + q)).sum(axis=0, dtype=np.float64)
+        result = 2 * (query.sum() + self._mass[rows] - 4 * shared)
+        return np.maximum(result, 0, out=result)
+    
+    def predict_batch(self, faces, top_k=None, shard=None):
+        """
+        Labels and confidences (lower is better) for a batch of crops in one gallery pass.
+        top_k overrides the recognizer's setting; 0 forces the exhaustive search.
+        shard (a RecognizerShard) restricts the search to its students.
+        """
+        faces = np.asarray(faces)
+        if shard is not None:
+            shard.sync(self)
+        if len(faces) == 0 or self.count == 0 or (shard is not None and len(shard.rows) == 0):
+            return np.full(len(faces), -1, dtype=np.int32), np.full(len(faces), np.inf)
+        queries = self.extract(faces)
+        top_k = self.top_k if top_k is None else top_k
+        students = self.student_count() if shard is None else len(shard.groups[2])
+        
+        if 0 < top_k < students:
+            # Stage two: exact distances only over each query's own candidate students
+            candidates = self.candidate_labels(queries, top_k, shard)
+            labels = np.empty(len(queries), dtype=np.int32)
+            confidence = np.empty(len(queries))
+            for i, query in enumerate(queries):
+                rows = self.rows_for_labels(candidates[i])
+                dist = self.candidate_distances(query, rows)
+                best = dist.argmin()
+                labels[i] = self.labels[rows[best]]
+                confidence[i] = dist[best]
+        else:
+            rows = np.arange(self.count) if shard is None else shard.rows
+            if shard is not None and len(rows) <= self.CANDIDATE_ROWS:
+                # A class-sized shard is as small as a candidate set, and scored the same way
+                dist = np.stack([self.candidate_distances(query, rows) for query in queries])
+            else:
+                dist = self.distances(queries, None if shard is None else rows)
+            best = dist.argmin(axis=1)
+            confidence = dist[np.arange(len(faces)), best].astype(np.float64)
+            labels = self.labels[rows[best]]
+        labels[confidence >= self.threshold] = -1
+        return labels, confidence
+    
+    def predict(self, face):
+        """Single-face prediction with the same (label, confidence) contract as OpenCV."""
+        labels, confidence = self.predict_batch(np.asarray(face)[None])
+        return int(labels[0]), float(confidence[0])
+    
+    def save(self, model_dir):
+        """
+        Write the model as plain .npy files so it can be loaded (or memory-mapped) in one read.
+        The prototype matrix is saved too, so memory-mapped readers do not rebuild their own.
+        """
+        os.makedirs(model_dir, exist_ok=True)
+        params = {'radius': self.radius, 'neighbors': self.neighbors,
+                  'grid_x': self.grid_x, 'grid_y': self.grid_y}
+        prototype_keys = np.array(list(self._proto_index), dtype=np.int32).reshape(-1, 2)
+        for name, value in (('histograms', self._histograms[:, :self.count]), ('labels', self.labels),
+                            ('poses', self.poses), ('prototypes', self._prototype_matrix()),
+                            ('prototype_keys', prototype_keys)):
+            tmp_path = os.path.join(model_dir, name + '.tmp.npy')
+            np.save(tmp_path, value)
+            os.replace(tmp_path, os.path.join(model_dir, name + '.npy'))
+        with open(os.path.join(model_dir, 'params.json'), 'w') as f:
+            json.dump(params, f)
+    
+    @classmethod
+    def load(cls, model_dir, top_k=0, mmap=False):
+        """
+        Load a saved model. With mmap the gallery and prototype matrices are memory-mapped
+        read-only, so processes that load the same model share one copy through the page
+        cache; such a recognizer can predict but not be updated.
+        """
+        with open(os.path.join(model_dir, 'params.json')) as f:
+            params = json.load(f)
+        recognizer = cls(top_k=top_k, **params)
+        mmap_mode = 'r' if mmap else None
+        histograms = np.load(os.path.join(model_dir, 'histograms.npy'), mmap_mode=mmap_mode)  # bins x samples
+        labels = np.load(os.path.join(model_dir, 'labels.npy'))
+        recognizer._histograms = histograms
+        recognizer._labels = labels
+        recognizer._mass = histograms.sum(axis=0, dtype=np.float32)
+        recognizer._poses = np.load(os.path.join(model_dir, 'poses.npy'))
+        recognizer.count = len(labels)
+        
+        prototypes_path = os.path.join(model_dir, 'prototypes.npy')
+        if mmap and os.path.exists(prototypes_path):
+            keys = np.load(os.path.join(model_dir, 'prototype_keys.npy'))
+            recognizer._proto_sqrt = np.load(prototypes_path, mmap_mode='r')
+            recognizer._proto_labels = keys[:, 0].copy()
+            recognizer._proto_index = {key: column for column, key in enumerate(map(tuple, keys.tolist()))}
+            recognizer._proto_sums = recognizer._proto_counts = None
+            return recognizer
+        recognizer._add_to_prototypes(histograms, labels, recognizer._poses)
+        recognizer._prototype_matrix()
+        return recognizer
+
+
+class RecognizerShard:
+    """
+    The part of an LBPHRecognizer's search space that covers some students, e.g. the class of an
+    attendance session: the rows of their samples and the columns of their prototypes. It holds
+    indices only, so a shard costs no copy of the histograms. Pass it to predict_batch(); it
+    re-derives its indices whenever it meets a different or changed recognizer.
+    """
+    
+    def __init__(self, labels):
+        self.labels = np.unique(np.asarray(list(labels), dtype=np.int32))
+        self.recognizer = None
+        self.version = None
+        self.rows = np.empty(0, dtype=np.intp)
+        self.columns = np.empty(0, dtype=np.intp)
+        self.groups = (self.columns, self.columns, self.labels[:0])
+    
+    def __len__(self):
+        return len(self.labels)
+    
+    def sync(self, recognizer):
+        if recognizer is self.recognizer and recognizer.version == self.version:
+            return self
+        proto_labels = recognizer._proto_labels[:len(recognizer._proto_index)]
+        columns = np.flatnonzero(np.isin(proto_labels, self.labels))
+        columns = columns[np.argsort(proto_labels[columns], kind='stable')]
+        sorted_labels = proto_labels[columns]
+        starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if len(columns) else columns
+        self.columns = columns
+        self.groups = (np.arange(len(columns)), starts, sorted_labels[starts])
+        self.rows = recognizer.rows_for_labels(self.labels)
+        self.recognizer = recognizer
+        self.version = recognizer.version
+        return self
+
+
+def search_report(recognizer, faces, top_k_values, batch_size=8):
+    """
+    Compare the two-stage search with the exhaustive one on the same crops, batch_size faces
+    at a time (about one frame's worth). Returns one dict per top_k value.
+    """
+    def run(top_k):
+        labels, confidences = [], []
+        start = time.perf_counter()
+        for i in range(0, len(faces), batch_size):
+            batch_labels, batch_confidences = recognizer.predict_batch(faces[i:i + batch_size], top_k=top_k)
+            labels.append(batch_labels)
+            confidences.append(batch_confidences)
+        elapsed = time.perf_counter() - start
+        return np.concatenate(labels), np.concatenate(confidences), elapsed
+    
+    exact_labels, exact_confidences, exhaustive_time = run(0)
+    report = []
+    for top_k in top_k_values:
+        labels, confidences, elapsed = run(top_k)
+        report.append({
+            'top_k': top_k,
+            'agreement': float(np.mean(labels == exact_labels)),
+            'max_confidence_delta': float(np.max(np.abs(confidences - exact_confidences))),
+            'ms_per_face': 1000 * elapsed / len(faces),
+            'exhaustive_ms_per_face': 1000 * exhaustive_time / len(faces),
+            'speedup': exhaustive_time / elapsed if elapsed else float('inf')
+        })
+    return report
+
+class SampleQuality:
+    """
+    Gate for registration crops. A crop is rejected when it is blurry (variance of the Laplacian),
+    badly exposed (mean grey level or contrast), was detected too small, or is a near-duplicate:
+    its LBP histogram lies within DUPLICATE_DISTANCE of a sample already kept for the student.
+    Duplicate histograms are taken from a lightly blurred crop, so sensor noise alone does not
+    make a repeated frame look new.
+    """
+    
+    def __init__(self, min_sharpness=QUALITY_MIN_SHARPNESS, brightness_range=QUALITY_BRIGHTNESS_RANGE,
+                 min_contrast=QUALITY_MIN_CONTRAST, min_face_size=QUALITY_MIN_FACE_SIZE,
+                 duplicate_distance=DUPLICATE_DISTANCE):
+        self.min_sharpness = min_sharpness
+        self.brightness_range = brightness_range
+        self.min_contrast = min_contrast
+        self.min_face_size = min_face_size
+        self.duplicate_distance = duplicate_distance
+        self.extractor = LBPHRecognizer()
+        self.kept = {}      # label -> (n, dim) histograms of the samples accepted so far
+    
+    def problem(self, crop, face_width=None):
+        """Why a crop is unusable on its own ("blurry", "dark", ...), or None."""
+        if face_width is not None and face_width < self.min_face_size:
+            return "too small"
+        if cv2.Laplacian(crop, cv2.CV_64F).var() < self.min_sharpness:
+            return "blurry"
+        brightness, contrast = cv2.meanStdDev(crop)
+        if brightness[0, 0] < self.brightness_range[0]:
+            return "too dark"
+        if brightness[0, 0] > self.brightness_range[1]:
+            return "too bright"
+        if contrast[0, 0] < self.min_contrast:
+            return "low contrast"
+        return None
+    
+    def histograms(self, crops):
+        return self.extractor.extract(np.array([cv2.GaussianBlur(crop, (0, 0), 1.0) for crop in crops]))
+    
+    def is_duplicate(self, label, histogram):
+        kept = self.kept.get(label)
+        if kept is None:
+            return False
+        total = kept + histogram
+        diff = (kept - histogram) ** 2
+        distances = 2 * np.divide(diff, total, out=np.zeros_like(diff), where=total > 0).sum(axis=1)
+        return bool(distances.min() < self.duplicate_distance)
+    
+    def keep(self, label, histograms):
+        histograms = np.atleast_2d(histograms)
+        kept = self.kept.get(label)
+        self.kept[label] = histograms if kept is None else np.concatenate([kept, histograms])
+    
+    def consider(self, label, crop, face_width=None):
+        """Check one crop and remember it when accepted; returns the rejection reason or None."""
+        reason = self.problem(crop, face_width)
+        if reason is not None:
+            return reason
+        histogram = self.histograms([crop])[0]
+        if self.is_duplicate(label, histogram):
+            return "duplicate"
+        self.keep(label, histogram)
+        return None
+    
+    def review(self, label, crops, candidates=None):
+        """
+        consider() for a student's stored crops in order, as if they were being captured now.
+        candidates optionally limits the review to some crops; the others are left out entirely.
+        Returns one reason (or None for kept) per crop, None also for those not reviewed.
+        """
+        reasons = [None] * len(crops)
+        self.kept.pop(label, None)
+        rows = range(len(crops)) if candidates is None else np.flatnonzero(candidates).tolist()
+        usable = []
+        for row in rows:
+            reasons[row] = self.problem(crops[row])
+            if reasons[row] is None:
+                usable.append(row)
+        if usable:
+            for row, histogram in zip(usable, self.histograms([crops[row] for row in usable])):
+                if self.is_duplicate(label, histogram):
+                    reasons[row] = "duplicate"
+                else:
+                    self.keep(label, histogram)
+        self.kept.pop(label, None)
+        return reasons
+
+
+def prune_samples(students, total, quality=None, queries=0, seed=0):
+    """
+    Apply the SampleQuality rules to stored samples. students yields (label, crops, poses) per
+    student and total is the number of crops over all of them. Returns (keep, evaluation):
+    keep lists one boolean array per student, and evaluation (None unless queries > 0) compares
+    prediction latency and accuracy with and without the dropped samples on about `queries`
+    held-out crops, which are left out of both galleries.
+    """
+    quality = quality or SampleQuality()
+    rng = np.random.default_rng(seed)
+    holdout_rate = min(queries / total, 0.5) if queries and total else 0
+    before, after = LBPHRecognizer(top_k=SEARCH_TOP_K), LBPHRecognizer(top_k=SEARCH_TOP_K)
+    held_out, truth = [], []
+    keep = []
+    for label, crops, poses in students:
+        reasons = quality.review(label, crops)
+        student_keep = np.array([reason is None for reason in reasons], dtype=bool)
+        keep.append(student_keep)
+        if not holdout_rate:
+            continue
+        
+        # Queries are kept crops; the pruning is redone without them so that neither gallery
+        # holds a sample that was judged against them
+        queried = student_keep & (rng.random(len(crops)) < holdout_rate)
+        if queried.sum() >= student_keep.sum():
+            queried[:] = False
+        candidates = ~queried
+        eval_keep = np.array([reason is None for reason in quality.review(label, crops, candidates)]) & candidates
+        histograms = before.extract(crops)
+        labels = np.full(len(crops), label, dtype=np.int32)
+        poses = np.asarray(poses, dtype=np.int32)
+        before._append(histograms[candidates], labels[candidates], poses[candidates])
+        after._append(histograms[eval_keep], labels[eval_keep], poses[eval_keep])
+        held_out.extend(np.asarray(crops)[queried])
+        truth.extend(labels[queried].tolist())
+    
+    if not held_out:
+        return keep, None
+    evaluation = {'queries': len(held_out)}
+    for name, recognizer in (('before', before), ('after', after)):
+        latencies, labels = [], []
+        for face in held_out:
+            start = time.perf_counter()
+            labels.append(recognizer.predict(face)[0])
+            latencies.append(1000 * (time.perf_counter() - start))
+        evaluation[name] = {
+            'samples': recognizer.count,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'accuracy': float(np.mean(np.array(labels) == np.array(truth)))
+        }
+    return keep, evaluation
+
+def face_size_bounds(frame_width, distance_range=SUBJECT_DISTANCE_RANGE, hfov_degrees=CAMERA_HFOV_DEGREES):
+    """
+    Expected face width in pixels at the nearest and farthest subject distance, with some slack,
+    for a camera with the given horizontal field of view. Returns (min_size, max_size).
+    """
+    scene_width = 2 * np.tan(np.radians(hfov_degrees) / 2)
+    near, far = distance_range
+    largest = frame_width * FACE_WIDTH_METERS / (near * scene_width)
+    smallest = frame_width * FACE_WIDTH_METERS / (far * scene_width)
+    return int(smallest * 0.8), int(largest * 1.25)
+
+
+class FaceDetector:
+    """
+    Haar cascade detection tuned for the attendance loop:
+    
+    - runs on a frame downscaled by `scale` and maps the boxes back to full resolution,
+      so recognition still crops from the full-resolution frame;
+    - between full scans (every full_scan_interval frames, or whenever nothing is being
+      followed) only searches regions around the previous frame's faces;
+    - bounds the face size from the expected subject distance (face_size_bounds).
+    
+    Timing is accumulated so detection FPS can be compared between configurations; the
+    downscale and detectMultiScale times are also recorded per frame in `metrics`.
+    """
+    
+    def __init__(self, cascade, scale=DETECT_SCALE, full_scan_interval=DETECT_FULL_SCAN_FRAMES,
+                 roi_margin=0.5, size_bounds='auto', scale_factor=1.3, min_neighbors=5, metrics=None):
+        self.cascade = cascade
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        self.scale = scale
+        self.full_scan_interval = full_scan_interval
+        self.roi_margin = roi_margin
+        self.size_bounds = size_bounds   # (min, max) in full-resolution pixels, 'auto' or None
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.previous = []               # last frame's boxes in downscaled coordinates
+        self.next_scale = None           # scale requested by set_scale(), applied before the next frame
+        self.frame_index = 0
+        self.frames = 0
+        self.seconds = 0.0
+    
+    @classmethod
+    def legacy(cls, cascade):
+        """The original full-resolution, full-frame detectMultiScale(gray, 1.3, 5)."""
+        return cls(cascade, scale=1.0, full_scan_interval=1, size_bounds=None)
+    
+    def fps(self):
+        return self.frames / self.seconds if self.seconds else 0.0
+    
+    def set_scale(self, scale):
+        """Change the detection scale from the next frame on; safe to call from another thread."""
+        self.next_scale = scale
+    
+    def _cascade(self, image, min_size, max_size):
+        if image.shape[0] < min_size[1] or image.shape[1] < min_size[0]:
+            return []
+        faces = self.cascade.detectMultiScale(image, self.scale_factor, self.min_neighbors,
+                                              minSize=min_size, maxSize=max_size)
+        return [tuple(int(v) for v in face) for face in faces]
+    
+    def detect(self, gray):
+        start = time.perf_counter()
+        if self.next_scale is not None:
+            # Carry the ROI boxes over to the new scale
+            scale, self.next_scale = self.next_scale, None
+            self.previous = [tuple(int(round(v * scale / self.scale)) for v in box) for box in self.previous]
+            self.scale = scale
+        if self.size_bounds == 'auto':
+            self.size_bounds = face_size_bounds(gray.shape[1])
+        if self.scale != 1.0:
+            small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        else:
+            small = gray
+        scaled = time.perf_counter()
+        
+        if self.size_bounds:
+            min_size = (max(24, int(self.size_bounds[0] * self.scale)),) * 2
+            max_size = (int(self.size_bounds[1] * self.scale),) * 2
+        else:
+            min_size, max_size = (0, 0), (0, 0)
+        
+        if not self.previous or self.frame_index % self.full_scan_interval == 0:
+            boxes = self._cascade(small, min_size, max_size)
+        else:
+            boxes = []
+            height, width = small.shape[:2]
+            for (x, y, w, h) in self.previous:
+                margin = int(self.roi_margin * max(w, h))
+                x0, y0 = max(0, x - margin), max(0, y - margin)
+                x1, y1 = min(width, x + w + margin), min(height, y + h + margin)
+                for (bx, by, bw, bh) in self._cascade(small[y0:y1, x0:x1], min_size, max_size):
+                    boxes.append((bx + x0, by + y0, bw, bh))
+            
+            # Neighbouring regions can find the same face twice; keep the larger box
+            boxes.sort(key=lambda box: box[2] * box[3], reverse=True)
+            unique = []
+            for box in boxes:
+                if all(FaceTracker.iou(box, kept) < 0.5 for kept in unique):
+                    unique.append(box)
+            boxes = unique
+        
+        self.previous = boxes
+        self.frame_index += 1
+        inverse = 1.0 / self.scale
+        result = np.array([[int(round(v * inverse)) for v in box] for box in boxes], dtype=np.int32).reshape(-1, 4)
+        
+        end = time.perf_counter()
+        self.metrics.record('downscale', scaled - start)
+        self.metrics.record('detectMultiScale', end - scaled)
+        self.seconds += end - start
+        self.frames += 1
+        return result
+
+
+class Track:
+    """One face followed across frames, with the recognition votes collected for it. Times are in seconds."""
+    
+    def __init__(self, track_id, box, now):
+        self.track_id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.last_recognized = None
+        self.votes = {}       # name -> number of recognitions ("Unknown" included)
+    
+    def add_vote(self, name, now):
+        self.votes[name] = self.votes.get(name, 0) + 1
+        self.last_recognized = now
+    
+    def leader(self):
+        """Best-supported known name and its vote share among all recognitions of the track."""
+        known = {name: count for name, count in self.votes.items() if name != "Unknown"}
+        if not known:
+            return "Unknown", 0, 0.0
+        name = max(known, key=known.get)
+        return name, known[name], known[name] / sum(self.votes.values())
+
+
+class FaceTracker:
+    """
+    Gives detections stable track IDs across frames so each face is recognized on its first
+    frame and then only re-checked every recheck_interval seconds. Detections are matched to
+    tracks greedily by IoU, falling back to centroid distance for fast movement.
+    
+    Time comes from the `now` passed to update() (e.g. the position in a recorded video),
+    or from time.monotonic().
+    """
+    
+    def __init__(self, iou_threshold=0.3, max_missed=TRACK_MAX_MISSED_SECONDS, recheck_interval=TRACK_RECHECK_SECONDS):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.recheck_interval = recheck_interval
+        self.tracks = {}
+        self.next_id = 0
+        self.now = 0.0
+    
+    @staticmethod
+    def iou(a, b):
+        ax, ay, aw, ah = a
+        bx, by, bw, bh = b
+        iw = min(ax + aw, bx + bw) - max(ax, bx)
+        ih = min(ay + ah, by + bh) - max(ay, by)
+        if iw <= 0 or ih <= 0:
+            return 0.0
+        inter = iw * ih
+        return inter / float(aw * ah + bw * bh - inter)
+    
+    @staticmethod
+    def centroid_close(a, b):
+        ax, ay, aw, ah = a
+        bx, by, bw, bh = b
+        dx = (ax + aw / 2) - (bx + bw / 2)
+        dy = (ay + ah / 2) - (by + bh / 2)
+        return dx * dx + dy * dy < (0.5 * max(aw, bw)) ** 2
+    
+    def update(self, boxes, now=None):
+        """Match this frame's detections to tracks; returns the tracks visible in this frame."""
+        self.now = time.monotonic() if now is None else now
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        
+        pairs = []
+        for track_id, track in self.tracks.items():
+            for i, box in enumerate(boxes):
+                overlap = self.iou(track.box, box)
+                if overlap >= self.iou_threshold:
+                    pairs.append((overlap, track_id, i))
+                elif self.centroid_close(track.box, box):
+                    pairs.append((0.0, track_id, i))
+        pairs.sort(reverse=True)
+        
+        matched_tracks = set()
+        matched_boxes = set()
+        visible = []
+        for _, track_id, i in pairs:
+            if track_id in matched_tracks or i in matched_boxes:
+                continue
+            track = self.tracks[track_id]
+            track.box = boxes[i]
+            track.last_seen = self.now
+            matched_tracks.add(track_id)
+            matched_boxes.add(i)
+            visible.append(track)
+        
+        for i, box in enumerate(boxes):
+            if i not in matched_boxes:
+                track = Track(self.next_id, box, self.now)
+                self.tracks[self.next_id] = track
+                self.next_id += 1
+                visible.append(track)
+        
+        # Forget tracks that have been out of view for too long
+        for track_id in [tid for tid, t in self.tracks.items() if self.now - t.last_seen > self.max_missed]:
+            del self.tracks[track_id]
+        return visible
+    
+    def needs_recognition(self, track):
+        return (track.last_recognized is None
+                or self.now - track.last_recognized >= self.recheck_interval)
+    
+    def confirmed_name(self, track, required_votes=TRACK_REQUIRED_VOTES, min_share=TRACK_MIN_AGREEMENT,
+                       min_seconds=TRACK_CONFIRM_SECONDS):
+        """The track's name once it has been followed long enough and enough recognitions agree on it."""
+        name, votes, share = track.leader()
+        if (name != "Unknown" and votes >= required_votes and share >= min_share
+                and self.now - track.first_seen >= min_seconds):
+            return name
+        return None
+
+
+class FrameScheduler:
+    """
+    Holds the attendance loop at target_fps on slow machines by shedding work. The pipeline
+    reports what each frame cost (detection plus recognition); every SCHEDULER_WINDOW frames
+    the average is compared with the 1 / target_fps budget and the loop moves one of
+    SCHEDULER_LEVELS up (cheaper) as soon as it is over, but only back down after
+    SCHEDULER_CALM_WINDOWS windows in a row well under it, so it settles instead of
+    oscillating between two levels. A level sets
+    how often detection runs (tracks keep their boxes in between), the detection scale, how
+    often a track is re-recognized and how many faces are recognized per frame.
+    """
+    
+    def __init__(self, detector, tracker, engine, target_fps=TARGET_FPS, levels=SCHEDULER_LEVELS,
+                 window=SCHEDULER_WINDOW, calm_windows=SCHEDULER_CALM_WINDOWS, metrics=None):
+        self.detector = detector
+        self.tracker = tracker
+        self.engine = engine
+        self.budget = 1.0 / target_fps
+        self.levels = levels
+        self.window = window
+        self.calm_windows = calm_windows
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        self.costs = []
+        self.calm = 0       # consecutive windows well under budget
+        self.level = None
+        self.apply(0)
+    
+    def apply(self, level):
+        """Switch to a level: reconfigure the detector, tracker and engine it controls."""
+        self.detect_interval, scale, recheck, max_recognitions = self.levels[level]
+        self.detector.set_scale(scale)
+        self.tracker.recheck_interval = recheck
+        self.engine.max_recognitions = max_recognitions
+        self.level = level
+        self.metrics.set_gauge('scheduler_level', level)
+    
+    def observe(self, seconds):
+        """Record one frame's processing time, adjusting the level at the end of each window."""
+        self.costs.append(seconds)
+        if len(self.costs) < self.window:
+            return
+        cost = sum(self.costs) / len(self.costs)
+        self.costs = []
+        self.calm = self.calm + 1 if cost < 0.6 * self.budget else 0
+        if cost > self.budget and self.level + 1 < len(self.levels):
+            self.apply(self.level + 1)
+        elif self.calm >= self.calm_windows and self.level > 0:
+            self.calm = 0
+            self.apply(self.level - 1)
+
+class LatestQueue:
+    """
+    Bounded hand-off between pipeline stages. When full, put() drops the oldest item instead of
+    blocking, so a slow consumer always gets the freshest frames rather than a growing backlog.
+    """
+    
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.items = deque()
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+    
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+    
+    def get(self, timeout=None):
+        """Oldest queued item, or None on timeout or once the queue is closed and empty."""
+        with self.cond:
+            self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            return self.items.popleft() if self.items else None
+    
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+    
+    def drained(self):
+        """True once the queue is closed and every item has been taken."""
+        with self.cond:
+            return self.closed and not self.items
+
+
+class StageMetrics:
+    """
+    Per-stage latency of the attendance loop. Every stage records its duration into a ring of
+    the latest `window` samples, from which p50/p95/p99 are computed on demand; recording is a
+    lock and a deque append, so it stays on in production. tick() is called once per displayed
+    frame for the FPS figure. Running totals are kept for the Prometheus summary.
+    """
+    
+    QUANTILES = (0.5, 0.95, 0.99)
+    
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.samples = {}     # stage -> deque of the latest durations in seconds
+        self.totals = {}      # stage -> [count, seconds] since start
+        self.gauges = {}
+        self.ticks = deque(maxlen=window)
+        self.frames = 0
+        self.lock = threading.Lock()
+    
+    def record(self, stage, seconds):
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.window)
+                self.totals[stage] = [0, 0.0]
+            samples.append(seconds)
+            total = self.totals[stage]
+            total[0] += 1
+            total[1] += seconds
+    
+    def tick(self):
+        with self.lock:
+            self.ticks.append(time.perf_counter())
+            self.frames += 1
+    
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+    
+    def fps(self, horizon=2.0):
+        """Frames per second over the last `horizon` seconds."""
+        now = time.perf_counter()
+        with self.lock:
+            recent = [t for t in self.ticks if now - t <= horizon]
+        if len(recent) < 2:
+            return 0.0
+        return (len(recent) - 1) / (recent[-1] - recent[0])
+    
+    def snapshot(self):
+        """{stage: {'p50', 'p95', 'p99' (seconds), 'count', 'sum'}} in the order stages first ran."""
+        with self.lock:
+            copies = {stage: (np.array(samples), list(self.totals[stage])) for stage, samples in self.samples.items()}
+        result = {}
+        for stage, (samples, (count, seconds)) in copies.items():
+            p50, p95, p99 = np.percentile(samples, [q * 100 for q in self.QUANTILES])
+            result[stage] = {'p50': p50, 'p95': p95, 'p99': p99, 'count': count, 'sum': seconds}
+        return result
+    
+    def summary_lines(self, snapshot=None):
+        """Human-readable lines for the status panel and the on-frame overlay."""
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        lines = [f"FPS {self.fps():5.1f}"]
+        for stage, stats in snapshot.items():
+            lines.append(f"{stage:<16} {stats['p50'] * 1000:6.1f} {stats['p95'] * 1000:6.1f} "
+                         f"{stats['p99'] * 1000:6.1f} ms")
+        return lines
+    
+    def prometheus_text(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP attendance_stage_seconds Latency of each attendance loop stage.",
+            "# TYPE attendance_stage_seconds summary"
+        ]
+        for stage, stats in self.snapshot().items():
+            for quantile in self.QUANTILES:
+                value = stats[f"p{round(quantile * 100)}"]
+                lines.append(f'attendance_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.6f}')
+            lines.append(f'attendance_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+            lines.append(f'attendance_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += [
+            "# HELP attendance_fps Frames displayed per second.",
+            "# TYPE attendance_fps gauge",
+            f"attendance_fps {self.fps():.2f}",
+            "# HELP attendance_frames_total Frames displayed since start.",
+            "# TYPE attendance_frames_total counter",
+            f"attendance_frames_total {self.frames}"
+        ]
+        for name, value in sorted(self.gauges.items()):
+            lines += [f"# TYPE attendance_{name} gauge", f"attendance_{name} {value}"]
+        return "\n".join(lines) + "\n"
+    
+    def write(self, path):
+        """Atomically replace `path` with the Prometheus text, e.g. for a node_exporter textfile collector."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def draw(frame, lines):
+        """Draw the summary lines in the frame's top-left corner."""
+        for i, line in enumerate(lines):
+            origin = (10, 20 + 18 * i)
+            cv2.putText(frame, line, origin, cv2.FONT_HERSHEY_PLAIN, 1.1, (0, 0, 0), 3)
+            cv2.putText(frame, line, origin, cv2.FONT_HERSHEY_PLAIN, 1.1, (255, 255, 255), 1)
+
+
+class MetricsServer:
+    """Serves StageMetrics as Prometheus text at http://127.0.0.1:<port>/metrics from a daemon thread."""
+    
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        import http.server
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] != '/metrics':
+                    handler.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+            
+            def log_message(handler, format, *args):
+                pass
+        
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AttendancePipeline:
+    """
+    The attendance loop split into threaded stages: frame grabbing, detection and recognition,
+    linked by drop-oldest LatestQueues. OpenCV releases the GIL inside read(), cvtColor(),
+    detectMultiScale() and the NumPy distance kernels, so the stages genuinely overlap.
+    
+    Results are left for the caller's thread (the Tk thread) to display and record:
+    results holds only the newest annotated frame, events every newly confirmed name.
+    Capture, colour conversion, detection and recognition times go to `metrics`.
+    
+    With stop_at_end (recorded videos and streams) a failed read ends the capture instead of
+    being retried; the remaining frames drain through the stages and `finished` is set once the
+    last is done. Such sources are read no faster than their own clock (CAP_PROP_POS_MSEC, or
+    the frame count over CAP_PROP_FPS), so a file plays like a camera instead of flooding the
+    drop-oldest queues, and that clock is passed to recognize as `now` for the tracker.
+    Camera frames get now=None, i.e. the wall clock.
+    
+    With a FrameScheduler, detection only runs on every scheduler.detect_interval-th frame (the
+    others reuse the last boxes) and every frame's processing time is reported to it.
+    """
+    
+    def __init__(self, capture, detect, recognize, queue_size=2, metrics=None, stop_at_end=False, scheduler=None):
+        self.capture = capture
+        self.scheduler = scheduler
+        self.stop_at_end = stop_at_end
+        self.detect = detect          # gray frame -> face boxes
+        self.recognize = recognize    # (gray frame, boxes, now) -> (annotations, confirmed names)
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        self.frames = LatestQueue(queue_size)
+        self.detections = LatestQueue(queue_size)
+        self.results = LatestQueue(1)
+        self.events = queue.Queue()   # confirmed names are never dropped
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._grab_loop, name="attendance-grab", daemon=True),
+            threading.Thread(target=self._detect_loop, name="attendance-detect", daemon=True),
+            threading.Thread(target=self._recognize_loop, name="attendance-recognize", daemon=True)
+        ]
+    
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+        for stage_queue in (self.frames, self.detections, self.results):
+            stage_queue.close()
+        for thread in self.threads:
+            thread.join(timeout=2)
+    
+    def _grab_loop(self):
+        fps = self.capture.get(cv2.CAP_PROP_FPS) if self.stop_at_end else 0
+        index = 0
+        origin = None    # (wall clock, video clock) of the first frame
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            if not ret:
+                if self.stop_at_end:
+                    self.frames.close()
+                    return
+                time.sleep(0.01)
+                continue
+            self.metrics.record('capture', time.perf_counter() - start)
+            position = None
+            if self.stop_at_end:
+                index += 1
+                position = self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 or (index / fps if fps > 0 else None)
+            if position is not None:
+                if origin is None:
+                    origin = (time.monotonic(), position)
+                # Live streams arrive at this pace anyway, so the wait only holds back files
+                delay = origin[0] + position - origin[1] - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    return
+            self.frames.put((frame, position))
+    
+    def _detect_loop(self):
+        index = 0
+        faces = None
+        while not self.stop_event.is_set():
+            item = self.frames.get(timeout=0.1)
+            if item is None:
+                if self.frames.drained():
+                    self.detections.close()
+                    return
+                continue
+            frame, position = item
+            start = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            converted = time.perf_counter()
+            if faces is None or self.scheduler is None or index % self.scheduler.detect_interval == 0:
+                faces = self.detect(gray)
+                self.metrics.record('detect', time.perf_counter() - converted)
+            index += 1
+            self.metrics.record('cvtColor', converted - start)
+            self.detections.put((frame, gray, faces, time.perf_counter() - start, position))
+    
+    def _recognize_loop(self):
+        reported = set()
+        while not self.stop_event.is_set():
+            item = self.detections.get(timeout=0.1)
+            if item is None:
+                if self.detections.drained():
+                    self.finished.set()
+                    return
+                continue
+            frame, gray, faces, detect_seconds, position = item
+            start = time.perf_counter()
+            annotations, confirmed = self.recognize(gray, faces, position)
+            recognize_seconds = time.perf_counter() - start
+            self.metrics.record('recognize', recognize_seconds)
+            if self.scheduler is not None:
+                self.scheduler.observe(detect_seconds + recognize_seconds)
+            self.results.put((frame, annotations))
+            for name in confirmed:
+                if name not in reported:
+                    reported.add(name)
+                    self.events.put(name)
+
+def model_is_current(manifest_path, model_path, gallery):
+    """True if the saved model was trained on exactly the gallery as it is on disk now."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (manifest.get('version') == MANIFEST_VERSION
+            and manifest.get('gallery') == gallery.signature()
+            and (not gallery.label_map or os.path.exists(model_path)))
+
+def save_model(recognizer, model_path, manifest_path, signature, write_model=True):
+    """
+    Persist the trained model and the gallery signature() it was trained from. Both are written
+    to temporary files first so an interrupted save never leaves a mismatched pair behind.
+    """
+    # Invalidate the old manifest first: a crash mid-save must force a retrain, not a bad load
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    if write_model:
+        if recognizer is not None:
+            recognizer.save(model_path)
+        elif os.path.exists(model_path):
+            shutil.rmtree(model_path)
+    
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'gallery': signature
+    }
+    tmp_manifest = manifest_path + '.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, manifest_path)
+
+def train_from_gallery(gallery, snapshot=None, progress=None):
+    """
+    Full LBPH training on every live gallery crop, streamed in TRAIN_BATCH_SIZE batches.
+    progress(crops done) is called after each batch; returning False from it abandons the run.
+    """
+    recognizer = LBPHRecognizer(top_k=SEARCH_TOP_K)
+    done = 0
+    for faces, labels, poses in gallery.iter_batches(snapshot=snapshot):
+        recognizer.update(faces, labels, poses)
+        done += len(labels)
+        if progress is not None and progress(done) is False:
+            return None
+    return None if recognizer.empty() else recognizer
+
+
+class ModelTrainer:
+    """
+    Full retrains on a background thread, so neither the Tk window nor a running attendance
+    loop waits for LBPH training.
+    
+    request() pins a snapshot of the gallery and trains on it in a new thread. The finished
+    model is saved and handed back on `results` together with its known-faces index, for the
+    Tk thread to swap in; until then the old model keeps serving. A new request supersedes
+    the running one, which stops after its current batch and whose result is dropped.
+    A load or training run that raises is reported as ('failed', generation, error) and
+    still completes, so busy() does not stay true.
+    All saves go through save(), so a background save and a foreground one never interleave.
+    """
+    
+    def __init__(self, gallery, model_path, manifest_path):
+        self.gallery = gallery
+        self.model_path = model_path
+        self.manifest_path = manifest_path
+        self.generation = 0     # bumped by every request; only the latest run's result is used
+        self.completed = 0      # generation of the last run that finished
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+    
+    def busy(self):
+        return self.completed != self.generation
+    
+    def request(self):
+        snapshot = self.gallery.snapshot()
+        signature = self.gallery.signature()
+        id_map = dict(self.gallery.id_map)
+        self.generation += 1
+        threading.Thread(target=self._train, args=(self.generation, snapshot, signature, id_map),
+                         name="model-trainer", daemon=True).start()
+        return self.generation
+    
+    def cancel(self):
+        """Drop the running request, if any."""
+        self.generation += 1
+        self.completed = self.generation
+    
+    def load(self):
+        """
+        Load the saved model in the background. It is handed back on `results` like a finished
+        training run (without being saved again), and a training request supersedes it.
+        """
+        snapshot = self.gallery.snapshot()
+        id_map = dict(self.gallery.id_map)
+        self.generation += 1
+        threading.Thread(target=self._load, args=(self.generation, snapshot, id_map),
+                         name="model-loader", daemon=True).start()
+        return self.generation
+    
+    def save(self, recognizer, signature, write_model=True):
+        with self.lock:
+            save_model(recognizer, self.model_path, self.manifest_path, signature, write_model)
+    
+    @staticmethod
+    def _known_faces(snapshot, id_map):
+        """One reference image per person, as refresh_known_faces() builds it."""
+        faces, index, live = snapshot
+        uniques, rows = np.unique(index['label'], return_index=True)
+        return {id_map[label]: faces[row] for label, row in zip(uniques.tolist(), rows.tolist())
+                if live[row] and label in id_map}
+    
+    def _fail(self, generation, error):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.completed = generation
+        self.results.put(('failed', generation, error))
+    
+    def _load(self, generation, snapshot, id_map):
+        try:
+            recognizer = LBPHRecognizer.load(self.model_path, top_k=SEARCH_TOP_K) if id_map else None
+            known_faces = self._known_faces(snapshot, id_map)
+        except Exception as e:
+            self._fail(generation, e)
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.completed = generation
+        self.results.put(('done', generation, recognizer, known_faces))
+    
+    def _train(self, generation, snapshot, signature, id_map):
+        faces, index, live = snapshot
+        total = int(live.sum())
+        
+        def progress(done):
+            self.results.put(('progress', generation, done, total))
+            return generation == self.generation
+        
+        try:
+            recognizer = train_from_gallery(self.gallery, snapshot, progress)
+            known_faces = self._known_faces(snapshot, id_map)
+            with self.lock:
+                if generation != self.generation:
+                    return
+                save_model(recognizer, self.model_path, self.manifest_path, signature)
+                self.completed = generation
+        except Exception as e:
+            self._fail(generation, e)
+            return
+        self.results.put(('done', generation, recognizer, known_faces))
+
+STUDENTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        roll_number TEXT NOT NULL,
+        faculty TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        registration_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        active INTEGER NOT NULL DEFAULT 1
+    )
+'''
+ATTENDANCE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id INTEGER NOT NULL REFERENCES students (id) ON DELETE RESTRICT,
+        attendance_date DATE NOT NULL,
+        attendance_time DATETIME NOT NULL,
+        status TEXT DEFAULT 'Absent'
+    )
+'''
+
+def create_schema(conn):
+    """
+    One students and one attendance table; faculty and year are columns, not table names.
+    Deleting a student only clears their `active` flag, so their attendance history stays in
+    reports and exports; roll numbers are unique among active students only.
+    """
+    conn.executescript(STUDENTS_TABLE.format(name='students') + ''';
+        CREATE INDEX IF NOT EXISTS idx_students_name ON students (name);
+        CREATE INDEX IF NOT EXISTS idx_students_roll_number ON students (roll_number);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_students_active_roll
+            ON students (faculty, year, roll_number) WHERE active = 1;
+    ''' + ATTENDANCE_TABLE.format(name='attendance') + ''';
+        CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance (student_id);
+    ''')
+    
+    # Marks per date, faculty and year, kept current by triggers on every insert and delete so
+    # reports never have to count the whole attendance table
+    summary_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_summary'").fetchone()
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS daily_summary (
+            attendance_date DATE NOT NULL,
+            faculty TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            present INTEGER NOT NULL,
+            PRIMARY KEY (attendance_date, faculty, year)
+        ) WITHOUT ROWID;
+        
+        -- Deleting a student used to delete their attendance and lower these totals
+        DROP TRIGGER IF EXISTS students_delete_attendance;
+        
+        CREATE TRIGGER IF NOT EXISTS daily_summary_insert AFTER INSERT ON attendance
+        BEGIN
+            INSERT INTO daily_summary (attendance_date, faculty, year, present)
+            SELECT NEW.attendance_date, faculty, year, 1 FROM students WHERE id = NEW.student_id
+            ON CONFLICT (attendance_date, faculty, year) DO UPDATE SET present = present + 1;
+        END;
+        
+        CREATE TRIGGER IF NOT EXISTS daily_summary_delete AFTER DELETE ON attendance
+        BEGIN
+            UPDATE daily_summary SET present = present - 1
+            WHERE attendance_date = OLD.attendance_date
+              AND (faculty, year) = (SELECT faculty, year FROM students WHERE id = OLD.student_id);
+        END;
+    ''')
+    if not summary_exists:
+        with conn:
+            conn.execute('''
+                INSERT INTO daily_summary (attendance_date, faculty, year, present)
+                SELECT a.attendance_date, s.faculty, s.year, COUNT(*)
+                FROM attendance a JOIN students s ON s.id = a.student_id
+                GROUP BY a.attendance_date, s.faculty, s.year
+            ''')
+    
+    # A student is marked at most once per date; the unique index makes the database refuse
+    # duplicates. Databases created before it existed keep the earliest mark of each day.
+    unique = {row[1]: row[2] for row in conn.execute("PRAGMA index_list(attendance)")}
+    if not unique.get('idx_attendance_date_student'):
+        with conn:
+            conn.execute('''
+                DELETE FROM attendance WHERE id NOT IN (
+                    SELECT MIN(id) FROM attendance GROUP BY attendance_date, student_id)
+            ''')
+            conn.execute("DROP INDEX IF EXISTS idx_attendance_date_student")
+            conn.execute('''
+                CREATE UNIQUE INDEX idx_attendance_date_student ON attendance (attendance_date, student_id)
+            ''')
+
+def migrate_legacy_tables(conn):
+    """
+    Move rows from the old {faculty}_Year{year}_Students/_Attendance tables into the normalized
+    schema and drop them, in one transaction. Repeated marks of a student on the same day collapse
+    to the earliest one. Returns (students, attendance rows) moved.
+    """
+    legacy = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    students = records = 0
+    with conn:
+        for faculty in FACULTIES:
+            for year in YEARS:
+                students_table = f"{faculty}_Year{year}_Students"
+                attendance_table = f"{faculty}_Year{year}_Attendance"
+                if students_table in legacy:
+                    students += conn.execute(f'''
+                        INSERT OR IGNORE INTO students (name, roll_number, faculty, year, registration_date)
+                        SELECT name, roll_number, ?, ?, registration_date FROM {students_table}
+                    ''', (faculty, year)).rowcount
+                if attendance_table in legacy:
+                    # The legacy tables kept the history of deleted students; re-create those students,
+                    # inactive, from their attendance rows so every row has a student to reference
+                    students += conn.execute(f'''
+                        INSERT INTO students (name, roll_number, faculty, year, registration_date, active)
+                        SELECT MIN(student_name), student_id, ?, ?, MIN(attendance_time), 0
+                        FROM {attendance_table} a
+                        WHERE NOT EXISTS (SELECT 1 FROM students s
+                                          WHERE s.faculty = ? AND s.year = ? AND s.roll_number = a.student_id)
+                        GROUP BY student_id
+                    ''', (faculty, year, faculty, year)).rowcount
+                    records += conn.execute(f'''
+                        INSERT OR IGNORE INTO attendance (student_id, attendance_date, attendance_time, status)
+                        SELECT s.id, a.attendance_date, a.attendance_time, a.status
+                        FROM {attendance_table} a
+                        JOIN students s ON s.faculty = ? AND s.year = ? AND s.roll_number = a.student_id
+                        ORDER BY a.id
+                    ''', (faculty, year)).rowcount
+                    conn.execute(f"DROP TABLE {attendance_table}")
+                if students_table in legacy:
+                    conn.execute(f"DROP TABLE {students_table}")
+    return students, records
+
+def migrate_student_history(conn):
+    """
+    Schema version 1 deleted a student's attendance along with them (ON DELETE CASCADE and a
+    trigger). Rebuild both tables in the current form, with the `active` flag and ON DELETE
+    RESTRICT, keeping every row and id. Returns True if the tables were rebuilt.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(students)")}
+    if not columns or 'active' in columns:
+        return False
+    # Rebuilt as the SQLite docs describe: foreign keys off, copy into new tables, swap names.
+    # The attendance triggers are dropped first (create_schema() recreates them) so copying
+    # rows does not count them again in daily_summary.
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with conn:
+            for trigger in ('students_delete_attendance', 'daily_summary_insert', 'daily_summary_delete'):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            conn.execute(STUDENTS_TABLE.format(name='students_v2'))
+            conn.execute('''
+                INSERT INTO students_v2 (id, name, roll_number, faculty, year, registration_date)
+                SELECT id, name, roll_number, faculty, year, registration_date FROM students
+            ''')
+            conn.execute(ATTENDANCE_TABLE.format(name='attendance_v2'))
+            conn.execute('''
+                INSERT INTO attendance_v2 (id, student_id, attendance_date, attendance_time, status)
+                SELECT id, student_id, attendance_date, attendance_time, status FROM attendance
+            ''')
+            conn.execute("DROP TABLE attendance")
+            conn.execute("DROP TABLE students")
+            conn.execute("ALTER TABLE students_v2 RENAME TO students")
+            conn.execute("ALTER TABLE attendance_v2 RENAME TO attendance")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return True
+
+def open_database(database_dir, setup=True, report=None):
+    """
+    Connection to the attendance database in WAL mode, so the attendance writer's commits
+    never block readers. With setup, the schema is created and legacy tables migrated, unless
+    the database's user_version shows that was already done for this SCHEMA_VERSION.
+    report(message), if given, is told what a migration did.
+    """
+    conn = sqlite3.connect(os.path.join(database_dir, 'attendance_system.db'), timeout=10)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")  # WAL stays consistent; only the last commits may roll back on power loss
+    conn.execute("PRAGMA foreign_keys = ON")
+    if not setup or conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+        return conn
+    migrate_student_history(conn)
+    create_schema(conn)
+    students, records = migrate_legacy_tables(conn)
+    if (students or records) and report is not None:
+        report(f"Migrated {students} students and {records} attendance records to the normalized schema")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return conn
+
+EXPORT_COLUMNS = ['ID', 'Name', 'Student ID', 'Faculty', 'Year', 'Date', 'Time', 'Status']
+EXPORT_FORMATS = ('csv', 'parquet', 'feather')
+
+def export_attendance_rows(conn, path, fmt='csv', start=None, end=None, faculty=None, year=None,
+                           chunk_size=EXPORT_CHUNK_ROWS):
+    """
+    Stream attendance rows (start <= date < end, optionally one faculty/year) from SQLite into a
+    CSV, Parquet or Feather file, chunk_size rows at a time, so memory does not grow with the
+    history. Parquet and Feather need pyarrow and are zstd-compressed. Returns the row count.
+    """
+    import pandas as pd
+    
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    if fmt != 'csv':
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(f"{fmt} export needs pyarrow (pip install pyarrow)")
+        schema = pa.schema([('ID', pa.int64()), ('Name', pa.string()), ('Student ID', pa.string()),
+                            ('Faculty', pa.string()), ('Year', pa.int64()), ('Date', pa.date32()),
+                            ('Time', pa.timestamp('us')), ('Status', pa.string())])
+    
+    # Filters run in SQLite; the date range uses the (attendance_date, student_id) index
+    conditions, params = [], []
+    for clause, value in (("a.attendance_date >= ?", start), ("a.attendance_date < ?", end),
+                          ("s.faculty = ?", faculty), ("s.year = ?", year)):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT a.id, s.name, s.roll_number, s.faculty, s.year, a.attendance_date, a.attendance_time, a.status
+        FROM attendance a JOIN students s ON s.id = a.student_id
+        {where} ORDER BY a.attendance_date, a.attendance_time
+    ''', params)
+    
+    tmp_path = path + '.tmp'
+    rows = 0
+    writer = None
+    with open(tmp_path, 'w', newline='') if fmt == 'csv' else pa.OSFile(tmp_path, 'wb') as sink:
+        if fmt == 'parquet':
+            writer = pa.parquet.ParquetWriter(sink, schema, compression='zstd')
+        elif fmt == 'feather':
+            writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+        
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk and rows:
+                break
+            df = pd.DataFrame(chunk, columns=EXPORT_COLUMNS)
+            if fmt == 'csv':
+                df.to_csv(sink, header=(rows == 0), index=False)
+            else:
+                df['Date'] = pd.to_datetime(df['Date']).dt.date
+                df['Time'] = pd.to_datetime(df['Time'], format='ISO8601')
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            rows += len(chunk)
+            if not chunk:
+                break
+        if writer is not None:
+            writer.close()
+    os.replace(tmp_path, path)
+    return rows
+
+def attendance_report(conn, start, end, faculty=None, year=None):
+    """
+    Attendance for start <= date < end, optionally one faculty/year. The counting runs in SQL
+    (on the date index and the daily_summary table) and the matrix is built with pandas.
+    Returns DataFrames:
+    
+    - 'Students': days present, class days held for the student's faculty/year, percentage;
+    - 'Matrix': one row per student, one column per class day: P(resent), A(bsent), or blank
+      when the student's own class did not meet that day;
+    - 'Rollup': per faculty/year enrolment, class days, marks and average attendance.
+    
+    A class day is a date on which at least one student of that faculty and year was marked.
+    """
+    import pandas as pd
+    
+    group_filter, group_params = "", []
+    for clause, value in (("faculty = ?", faculty), ("year = ?", year)):
+        if value is not None:
+            group_filter += f" AND {clause}"
+            group_params.append(value)
+    
+    students = pd.read_sql_query(f'''
+        SELECT id, name AS Name, roll_number AS "Roll Number", faculty AS Faculty, year AS Year
+        FROM students
+        WHERE (active = 1 OR EXISTS (SELECT 1 FROM attendance a WHERE a.student_id = students.id
+                                     AND a.attendance_date >= ? AND a.attendance_date < ?)){group_filter}
+        ORDER BY faculty, year, roll_number
+    ''', conn, params=[start, end] + group_params)
+    summary = pd.read_sql_query(f'''
+        SELECT attendance_date, faculty AS Faculty, year AS Year, present
+        FROM daily_summary WHERE attendance_date >= ? AND attendance_date < ? AND present > 0{group_filter}
+    ''', conn, params=[start, end] + group_params)
+    marks = pd.read_sql_query(f'''
+        SELECT a.student_id AS id, a.attendance_date
+        FROM attendance a JOIN students s ON s.id = a.student_id
+        WHERE a.attendance_date >= ? AND a.attendance_date < ?{group_filter.replace(" AND ", " AND s.")}
+    ''', conn, params=[start, end] + group_params)
+    
+    # Per-student percentages against the days their own class met
+    class_days = summary.groupby(['Faculty', 'Year']).size().rename('Class Days')
+    present = marks.groupby('id').size().rename('Days Present')
+    report = students.join(present, on='id').join(class_days, on=['Faculty', 'Year'])
+    report[['Days Present', 'Class Days']] = report[['Days Present', 'Class Days']].fillna(0).astype(int)
+    report['Attendance %'] = (100.0 * report['Days Present'] / report['Class Days'].where(report['Class Days'] > 0)).round(1)
+    
+    # Student-by-day matrix, scattered with NumPy indexing (crosstab/pivot aggregate in Python)
+    days = pd.Index(sorted(summary['attendance_date'].unique()))
+    was_present = np.zeros((len(students), len(days)), dtype=bool)
+    was_present[pd.Index(students['id']).get_indexer(marks['id']),
+                days.get_indexer(marks['attendance_date'])] = True
+    groups = pd.MultiIndex.from_frame(students[['Faculty', 'Year']]).unique()
+    held = np.zeros((len(groups) + 1, len(days)), dtype=bool)   # last row absorbs groups with nobody enrolled
+    held[groups.get_indexer(pd.MultiIndex.from_frame(summary[['Faculty', 'Year']])),
+         days.get_indexer(summary['attendance_date'])] = True
+    held = held[groups.get_indexer(pd.MultiIndex.from_frame(students[['Faculty', 'Year']]))]
+    matrix = pd.DataFrame(np.where(was_present, 'P', np.where(held, 'A', '')), columns=days)
+    matrix = pd.concat([students[['Name', 'Roll Number', 'Faculty', 'Year']], matrix], axis=1)
+    
+    # Faculty/year rollup
+    rollup = report.groupby(['Faculty', 'Year']).agg(
+        Enrolled=('id', 'size'), **{'Class Days': ('Class Days', 'first'), 'Marks': ('Days Present', 'sum')})
+    possible = rollup['Enrolled'] * rollup['Class Days']
+    rollup['Average Attendance %'] = (100.0 * rollup['Marks'] / possible.where(possible > 0)).round(1)
+    
+    return {
+        'Students': report.drop(columns='id'),
+        'Matrix': matrix,
+        'Rollup': rollup.reset_index()
+    }
+
+def write_report(report, filename):
+    """One sheet per report table."""
+    import pandas as pd
+    
+    with pd.ExcelWriter(filename) as excel:
+        for sheet, df in report.items():
+            df.to_excel(excel, sheet_name=sheet, index=False)
+
+def insert_attendance(cursor, student_id, timestamp):
+    """
+    Insert an attendance row for the student. Returns False if the student already has a row
+    for that date (the unique index refuses it).
+    """
+    cursor.execute('''
+        INSERT OR IGNORE INTO attendance (student_id, attendance_date, attendance_time) 
+        VALUES (?, ?, ?)
+    ''', (student_id, timestamp.date(), timestamp))
+    return cursor.rowcount > 0
+
+
+class Student:
+    """One row of the students table, plus the student's gallery label once they have crops."""
+    
+    def __init__(self, student_id, name, roll_number, faculty, year, registration_date=None, label=None):
+        self.student_id = student_id
+        self.name = name
+        self.roll_number = roll_number
+        self.faculty = faculty
+        self.year = year
+        self.registration_date = registration_date
+        self.label = label
+
+
+class StudentDirectory:
+    """
+    The students table held in memory, indexed by name, (faculty, year, roll number) and gallery
+    label. It is loaded once and kept current by add()/remove()/set_label() as students are
+    registered, deleted or given new crops, so lookups on the attendance path never hit SQLite.
+    """
+    
+    def __init__(self):
+        self.by_name = {}     # name -> Student (the first registered, as the old per-table scan found)
+        self.by_roll = {}     # (faculty, year, roll_number) -> Student
+        self.by_label = {}    # gallery label -> Student
+    
+    @classmethod
+    def load(cls, conn, label_map=None):
+        directory = cls()
+        rows = conn.execute('''
+            SELECT id, name, roll_number, faculty, year, registration_date FROM students
+            WHERE active = 1 ORDER BY id
+        ''').fetchall()
+        for row in rows:
+            directory.add(Student(*row))
+        for name, label in (label_map or {}).items():
+            directory.set_label(name, label)
+        return directory
+    
+    def __len__(self):
+        return len(self.by_roll)
+    
+    def add(self, student):
+        self.by_name.setdefault(student.name, student)
+        self.by_roll[(student.faculty, int(student.year), student.roll_number)] = student
+        if student.label is not None:
+            self.by_label[student.label] = student
+    
+    def remove(self, name):
+        """Forget every student registered under name."""
+        for key, student in list(self.by_roll.items()):
+            if student.name == name:
+                del self.by_roll[key]
+                if student.label is not None:
+                    self.by_label.pop(student.label, None)
+        self.by_name.pop(name, None)
+    
+    def set_label(self, name, label):
+        student = self.by_name.get(name)
+        if student is not None:
+            student.label = label
+            self.by_label[label] = student
+    
+    def get(self, name):
+        return self.by_name.get(name)
+    
+    def roll_exists(self, faculty, year, roll_number):
+        return (faculty, int(year), roll_number) in self.by_roll
+    
+    def labels_for(self, faculty=None, year=None):
+        """Gallery labels of the students in one faculty and/or year (None matches any)."""
+        return {student.label for (student_faculty, student_year, _), student in self.by_roll.items()
+                if student.label is not None and faculty in (None, student_faculty) and year in (None, student_year)}
+    
+    def roster_labels(self, entries):
+        """Gallery labels for roster entries given as names or roll numbers; returns (labels, unmatched)."""
+        by_roll_number = {}
+        for (_, _, roll_number), student in self.by_roll.items():
+            by_roll_number.setdefault(roll_number, []).append(student)
+        labels, unmatched = set(), []
+        for entry in entries:
+            students = [self.by_name[entry]] if entry in self.by_name else by_roll_number.get(entry, [])
+            if not students:
+                unmatched.append(entry)
+            labels.update(student.label for student in students if student.label is not None)
+        return labels, unmatched
+
+
+def read_roster(path):
+    """Names or roll numbers from a roster file: the first column of each non-empty line (text or CSV)."""
+    with open(path, newline='') as f:
+        return [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+
+
+class AttendanceStore:
+    """
+    Attendance entries ({'name', 'timestamp', 'date'}) bucketed by date. Days are loaded from
+    the database on first use with one indexed query and kept in an LRU cache of max_days
+    buckets; today's bucket is never evicted, since it also holds marks the writer has not
+    committed yet. "Marked today" is answered from the bucket of the current date, so it
+    rolls over by itself at midnight.
+    """
+    
+    def __init__(self, conn, writer=None, max_days=ATTENDANCE_CACHE_DAYS):
+        self.conn = conn
+        self.writer = writer        # flushed before reading, so queued marks are not missed
+        self.max_days = max_days
+        self.days = OrderedDict()   # date -> entries sorted by time
+        self.names = {}             # date -> names with an entry that day
+    
+    def _query(self, where, params):
+        if self.writer is not None:
+            self.writer.flush()
+        rows = self.conn.execute(f'''
+            SELECT s.name, a.attendance_date, a.attendance_time
+            FROM attendance a JOIN students s ON s.id = a.student_id
+            WHERE {where} ORDER BY a.attendance_date, a.attendance_time
+        ''', params).fetchall()
+        return [{'name': name,
+                 'timestamp': datetime.fromisoformat(str(timestamp)),
+                 'date': datetime.strptime(str(date), '%Y-%m-%d').date()}
+                for name, date, timestamp in rows]
+    
+    def day(self, date):
+        """Entries of one date, oldest first."""
+        if date in self.days:
+            self.days.move_to_end(date)
+            return self.days[date]
+        
+        entries = self._query("a.attendance_date = ?", (date,))
+        self.days[date] = entries
+        self.names[date] = {entry['name'] for entry in entries}
+        today = datetime.now().date()
+        for cached in list(self.days):
+            if len(self.days) <= self.max_days:
+                break
+            if cached != today:
+                del self.days[cached]
+                del self.names[cached]
+        return entries
+    
+    def between(self, start, end):
+        """Entries with start <= date < end, oldest first."""
+        return self._query("a.attendance_date >= ? AND a.attendance_date < ?", (start, end))
+    
+    def today(self):
+        return self.day(datetime.now().date())
+    
+    def is_marked(self, name, date=None):
+        date = date or datetime.now().date()
+        self.day(date)
+        return name in self.names[date]
+    
+    def add(self, name, timestamp):
+        """Record a mark in its day's bucket (the database write is the writer's job)."""
+        date = timestamp.date()
+        entries = self.day(date)
+        entries.append({'name': name, 'timestamp': timestamp, 'date': date})
+        self.names[date].add(name)
+
+
+class AttendanceWriter:
+    """
+    Writes attendance off the video loop. A dedicated thread owns its own WAL connection and
+    commits queued marks in groups: as soon as batch_size marks are waiting, or flush_ms after
+    the first one of a group arrived. close() flushes whatever is still queued.
+    Each group's commit time is recorded in `metrics`; a group that fails to commit is
+    described on `errors` for the caller to show.
+    """
+    
+    def __init__(self, database_dir, batch_size=ATTENDANCE_BATCH_SIZE, flush_ms=ATTENDANCE_FLUSH_MS,
+                 metrics=None):
+        self.database_dir = database_dir
+        self.metrics = metrics if metrics is not None else StageMetrics()
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.marks = queue.Queue()
+        self.written = 0
+        self.duplicates = 0
+        self.commits = 0
+        self.errors = queue.Queue()
+        self.thread = threading.Thread(target=self._write_loop, name="attendance-writer", daemon=True)
+        self.thread.start()
+    
+    def submit(self, student_id, timestamp=None):
+        self.marks.put((student_id, timestamp or datetime.now()))
+    
+    def flush(self):
+        """Block until every mark submitted so far is committed."""
+        self.marks.join()
+    
+    def close(self):
+        self.marks.put(None)
+        self.thread.join()
+    
+    def _write_loop(self):
+        conn = open_database(self.database_dir, setup=False)
+        cursor = conn.cursor()
+        closing = False
+        while not closing:
+            mark = self.marks.get()
+            if mark is None:
+                self.marks.task_done()
+                break
+            batch = [mark]
+            deadline = time.monotonic() + self.flush_ms / 1000.0
+            while len(batch) < self.batch_size:
+                try:
+                    mark = self.marks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if mark is None:
+                    self.marks.task_done()
+                    closing = True
+                    break
+                batch.append(mark)
+            
+            start = time.perf_counter()
+            try:
+                with conn:
+                    for student_id, timestamp in batch:
+                        if insert_attendance(cursor, student_id, timestamp):
+                            self.written += 1
+                        else:
+                            self.duplicates += 1
+                self.commits += 1
+                self.metrics.record('commit', time.perf_counter() - start)
+            except sqlite3.Error as e:
+                self.errors.put(f"Failed to write {len(batch)} attendance marks: {e}")
+            finally:
+                for _ in batch:
+                    self.marks.task_done()
+        conn.close()
+
+
+class AttendanceEngine:
+    """
+    Detection and recognition without any GUI: the live Tk loop and the headless batch
+    command both drive this. Attendance is not written here; callers receive confirmed names
+    and record them through an AttendanceWriter or insert_attendance().
+    """
+    
+    def __init__(self, cascade, recognizer, id_map, threshold=RECOGNITION_THRESHOLD, metrics=None, shard=None,
+                 max_recognitions=None, shard_threshold=SHARD_ACCEPT_THRESHOLD):
+        self.cascade = cascade
+        self.recognizer = recognizer
+        self.id_map = id_map
+        self.shard = shard              # session's RecognizerShard; None searches everyone
+        self.threshold = threshold
+        self.shard_threshold = shard_threshold  # shard matches trusted without a full search
+        self.max_recognitions = max_recognitions  # tracks recognized per frame at most; None = all due
+        self.metrics = metrics if metrics is not None else StageMetrics()
+    
+    @classmethod
+    def from_database(cls, database_dir):
+        """
+        Engine on the saved model, memory-mapped so processes on the same database share it.
+        The caller retrains and saves the model first if the gallery changed since (see
+        batch_command); it is never trained here, where every pool worker would repeat it.
+        """
+        gallery = GalleryStore(os.path.join(database_dir, "gallery"))
+        model_path = os.path.join(database_dir, "lbph_model")
+        if gallery.label_map and os.path.exists(os.path.join(model_path, 'params.json')):
+            recognizer = LBPHRecognizer.load(model_path, top_k=SEARCH_TOP_K, mmap=True)
+        else:
+            recognizer = None
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        return cls(cascade, recognizer, dict(gallery.id_map))
+    
+    def identify(self, gray, boxes):
+        """
+        Name ("Unknown" below the threshold) for each box, recognized in one batch. With a session
+        shard, only close matches (under shard_threshold) are taken from it; the other faces are
+        searched again against the whole gallery, whose match wins if it is closer, so a student
+        from another class is not given the name of their nearest classmate.
+        """
+        recognizer = self.recognizer    # a model swapped in meanwhile is used from the next call on
+        shard = self.shard
+        if not len(boxes) or recognizer is None:
+            return ["Unknown"] * len(boxes)
+        start = time.perf_counter()
+        crops = [cv2.resize(gray[y:y+h, x:x+w], (FACE_SIZE, FACE_SIZE)) for (x, y, w, h) in boxes]
+        resized = time.perf_counter()
+        crops = np.array(crops)
+        labels, confidences = recognizer.predict_batch(crops, shard=shard)
+        predicted = time.perf_counter()
+        self.metrics.record('resize', resized - start)
+        self.metrics.record('predict', predicted - resized)
+        if shard is not None:
+            doubtful = np.flatnonzero(confidences >= self.shard_threshold)
+            if len(doubtful):
+                full_labels, full_confidences = recognizer.predict_batch(crops[doubtful])
+                closer = full_confidences < confidences[doubtful]
+                labels[doubtful[closer]] = full_labels[closer]
+                confidences[doubtful[closer]] = full_confidences[closer]
+                self.metrics.record('fallback', time.perf_counter() - predicted)
+        return [self.id_map.get(int(label), "Unknown") if confidence < self.threshold else "Unknown"
+                for label, confidence in zip(labels, confidences)]
+    
+    def recognize_faces(self, tracker, gray, faces, now=None):
+        """
+        Recognition stage of the attendance pipeline: update the tracks, recognize the ones that
+        are due in one batch, and return ([(box, name)], confirmed names) for this frame.
+        With max_recognitions set, new tracks go first, then those waiting longest.
+        """
+        tracks = tracker.update(faces, now)
+        
+        # Score every due track in the frame against the gallery in one pass
+        due = [track for track in tracks if tracker.needs_recognition(track)]
+        if self.max_recognitions is not None and len(due) > self.max_recognitions:
+            due.sort(key=lambda track: -np.inf if track.last_recognized is None else track.last_recognized)
+            due = due[:self.max_recognitions]
+        for track, name in zip(due, self.identify(gray, [track.box for track in due])):
+            track.add_vote(name, tracker.now)
+        
+        annotations = []
+        confirmed = []
+        for track in tracks:
+            annotations.append((track.box, track.leader()[0]))
+            name = tracker.confirmed_name(track)
+            if name:
+                confirmed.append(name)
+        return annotations, confirmed
+    
+    def process_video(self, capture, stride=1):
+        """
+        Run a recorded video or stream to the end. Returns ({name: seconds into the video when
+        the name was confirmed}, frames processed, faces detected).
+        """
+        tracker = FaceTracker()
+        detector = FaceDetector(self.cascade)
+        seen = {}
+        frames = faces_found = 0
+        index = 0
+        started = time.monotonic()
+        while True:
+            # grab() skips decoding the frames that stride leaves out
+            if not capture.grab():
+                break
+            index += 1
+            if (index - 1) % stride:
+                continue
+            ret, frame = capture.retrieve()
+            if not ret:
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = detector.detect(gray)
+            
+            # Tracks run on the video's own clock, so the result does not depend on processing speed;
+            # streams that report no position fall back to the wall clock
+            position = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 or time.monotonic() - started
+            _, confirmed = self.recognize_faces(tracker, gray, faces, now=position)
+            frames += 1
+            faces_found += len(faces)
+            for name in confirmed:
+                seen.setdefault(name, position)
+        return seen, frames, faces_found
+    
+    def process_images(self, paths):
+        """
+        Recognize every face in a set of unrelated still images. There is no track to vote over,
+        so a single match below the threshold counts. Returns ({name: 0.0}, images read, faces detected).
+        """
+        detector = FaceDetector(self.cascade, full_scan_interval=1, size_bounds=None)
+        seen = {}
+        images = faces_found = 0
+        for path in paths:
+            frame = cv2.imread(path)
+            if frame is None:
+                continue
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            faces = detector.detect(gray)
+            images += 1
+            faces_found += len(faces)
+            for name in self.identify(gray, faces):
+                if name != "Unknown":
+                    seen.setdefault(name, 0.0)
+        return seen, images, faces_found
+    
+    def process_source(self, source, stride=1):
+        """Process an image directory, a video file or a stream URL; see process_video()."""
+        if os.path.isdir(source):
+            paths = sorted(os.path.join(source, entry) for entry in os.listdir(source)
+                           if entry.lower().endswith(IMAGE_EXTENSIONS))
+            return self.process_images(paths)
+        capture = open_source(source)
+        if not capture.isOpened():
+            raise IOError(f"cannot open {source}")
+        try:
+            return self.process_video(capture, stride)
+        finally:
+            capture.release()
+
+
+# Batch workers build one engine per process (the model is loaded once, not once per input)
+_batch_engine = None
+
+def _init_batch_worker(database_dir):
+    global _batch_engine
+    cv2.setNumThreads(1)  # parallelism comes from the process pool
+    _batch_engine = AttendanceEngine.from_database(database_dir)
+
+def _process_batch_source(source, stride):
+    start = time.perf_counter()
+    try:
+        seen, frames, faces = _batch_engine.process_source(source, stride)
+    except Exception as error:
+        return {'source': source, 'error': str(error)}
+    return {'source': source, 'seen': seen, 'frames': frames, 'faces': faces,
+            'seconds': time.perf_counter() - start}
+
+
+def draw_annotations(frame, annotations, is_marked):
+    """Boxes and "name - Marked / Not Marked" labels for one frame's recognized faces."""
+    for (x, y, w, h), recognized_name in annotations:
+        color = (0, 255, 0) if recognized_name != "Unknown" else (0, 0, 255)
+        cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
+        status = "Marked" if is_marked(recognized_name) else "Not Marked"
+        cv2.putText(frame, f"{recognized_name} - {status}",
+                    (x, y-10), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.6, color, 2)
+
+def _camera_worker(source, model_dir, id_map, events, stop_event, marked, show, threads, session_labels=None,
+                   target_fps=TARGET_FPS):
+    """
+    One source of MultiCameraAttendance, run in its own process with its own AttendancePipeline.
+    The recognizer is memory-mapped from model_dir, so all workers share one copy of it.
+    Confirmed names are sent to the parent as ('mark', name, source, timestamp).
+    """
+    cv2.setNumThreads(threads)
+    recognizer = None
+    if id_map and os.path.exists(os.path.join(model_dir, 'params.json')):
+        recognizer = LBPHRecognizer.load(model_dir, top_k=SEARCH_TOP_K, mmap=True)
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    metrics = StageMetrics()
+    shard = RecognizerShard(session_labels) if session_labels is not None else None
+    engine = AttendanceEngine(cascade, recognizer, id_map, metrics=metrics, shard=shard)
+    tracker = FaceTracker()
+    detector = FaceDetector(cascade, metrics=metrics)
+    scheduler = FrameScheduler(detector, tracker, engine, target_fps, metrics=metrics) if target_fps else None
+    capture = open_source(source)
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    pipeline = AttendancePipeline(
+        capture,
+        detector.detect,
+        lambda gray, faces, now: engine.recognize_faces(tracker, gray, faces, now),
+        metrics=metrics,
+        stop_at_end=not str(source).isdigit(),
+        scheduler=scheduler
+    )
+    pipeline.start()
+    
+    marked = set(marked)
+    window = f"Attendance System - {source}"
+    overlay = False
+    started = time.perf_counter()
+    while not stop_event.is_set():
+        finished = pipeline.finished.is_set()
+        result = pipeline.results.get(timeout=0.02)
+        if result is not None:
+            frame, annotations = result
+            metrics.tick()
+            if show:
+                draw_annotations(frame, annotations, marked.__contains__)
+                if overlay:
+                    StageMetrics.draw(frame, metrics.summary_lines())
+                cv2.imshow(window, frame)
+        
+        while not pipeline.events.empty():
+            name = pipeline.events.get_nowait()
+            marked.add(name)
+            events.put(('mark', name, source, datetime.now()))
+        
+        if show:
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                stop_event.set()
+            elif key == ord('m'):
+                overlay = not overlay
+        if finished:
+            break
+    
+    pipeline.stop()
+    capture.release()
+    if show:
+        cv2.destroyWindow(window)
+    events.put(('done', source, metrics.frames, time.perf_counter() - started))
+
+
+class MultiCameraAttendance:
+    """
+    Attendance from several cameras or videos at once, one worker process per source so the
+    sources run on separate cores. Every worker memory-maps the same saved model instead of
+    loading its own copy.
+    
+    Confirmed names from all workers arrive on one queue. poll() merges them and passes each
+    name on only the first time any source confirms it (names in `marked` are never passed on),
+    so the caller writes every student once however many cameras saw them.
+    session_labels restricts recognition to a session's students (see RecognizerShard).
+    """
+    
+    def __init__(self, sources, model_dir, id_map, marked=(), show=True, session_labels=None, target_fps=TARGET_FPS):
+        import multiprocessing
+        
+        context = multiprocessing.get_context('spawn')
+        self.sources = [str(source) for source in sources]
+        self.events = context.Queue()
+        self.stop_event = context.Event()
+        self.reported = set(marked)
+        self.running = set(self.sources)
+        self.stats = {}             # source -> (frames, seconds) once its worker is done
+        threads = max(1, (os.cpu_count() or 1) // len(self.sources))
+        self.workers = [
+            context.Process(target=_camera_worker, name=f"camera-{source}", daemon=True,
+                            args=(source, model_dir, dict(id_map), self.events, self.stop_event,
+                                  sorted(marked), show, threads,
+                                  None if session_labels is None else sorted(session_labels), target_fps))
+            for source in self.sources
+        ]
+    
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+    
+    def active(self):
+        return bool(self.running) and any(worker.is_alive() for worker in self.workers)
+    
+    def poll(self, timeout=0.0):
+        """[(name, source, timestamp)] of names confirmed for the first time since the last poll."""
+        new = []
+        while True:
+            try:
+                event = self.events.get(timeout=timeout)
+            except queue.Empty:
+                break
+            timeout = 0.0
+            if event[0] == 'done':
+                _, source, frames, seconds = event
+                self.running.discard(source)
+                self.stats[source] = (frames, seconds)
+                continue
+            _, name, source, timestamp = event
+            if name not in self.reported:
+                self.reported.add(name)
+                new.append((name, source, timestamp))
+        return new
+    
+    def stop(self):
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+
+class VirtualTable:
+    """
+    A Treeview that only materializes the rows that fit on screen. The rows live in a Python
+    list; scrolling rewrites the values of a fixed set of visible items instead of the widget
+    holding thousands of items, so filling or refreshing a large day costs one redraw.
+    format_row(row) turns a stored row into the column values when it becomes visible.
+    """
+    
+    def __init__(self, parent, columns, widths, format_row, row_height=20):
+        self.format_row = format_row
+        self.row_height = row_height
+        self.rows = []
+        self.offset = 0
+        self.visible = 0
+        
+        frame = ttk.Frame(parent)
+        frame.pack(fill='both', expand=True)
+        self.tree = ttk.Treeview(frame, columns=columns, show='headings', height=1)
+        for column in columns:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=widths.get(column, 80))
+        self.scrollbar = ttk.Scrollbar(frame, orient='vertical', command=self._on_scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar.pack(side='right', fill='y')
+        
+        self.tree.bind('<Configure>', self._on_configure)
+        self.tree.bind('<MouseWheel>', lambda event: self.scroll(-1 if event.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.scroll(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.scroll(1, 'units'))
+    
+    def set_rows(self, rows):
+        self.rows = rows
+        self.offset = 0
+        self.render()
+    
+    def append(self, rows):
+        """Add rows at the end, following them if the view was already at the bottom."""
+        at_bottom = self.offset + self.visible >= len(self.rows)
+        self.rows.extend(rows)
+        if at_bottom:
+            self.offset = max(0, len(self.rows) - self.visible)
+        self.render()
+    
+    def scroll(self, amount, what):
+        step = self.visible if what == 'pages' else 1
+        self._move_to(self.offset + int(amount) * step)
+    
+    def _move_to(self, offset):
+        offset = max(0, min(offset, len(self.rows) - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+    
+    def _on_scroll(self, action, amount, what=None):
+        if action == 'moveto':
+            self._move_to(int(float(amount) * len(self.rows)))
+        else:
+            self.scroll(amount, what)
+    
+    def _on_configure(self, event):
+        # The heading takes roughly one row
+        visible = max(1, event.height // self.row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self.offset = max(0, min(self.offset, len(self.rows) - visible))
+            self.render()
+    
+    def render(self):
+        items = self.tree.get_children()
+        window = self.rows[self.offset:self.offset + self.visible]
+        for item, row in zip(items, window):
+            self.tree.item(item, values=self.format_row(row))
+        for row in window[len(items):]:
+            self.tree.insert('', 'end', values=self.format_row(row))
+        if len(items) > len(window):
+            self.tree.delete(*items[len(window):])
+        
+        if self.rows:
+            self.scrollbar.set(self.offset / len(self.rows),
+                               min(1.0, (self.offset + self.visible) / len(self.rows)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
 
 class AttendanceSystemGUI:
     
-    def __init__(self, root):
+    def __init__(self, root, camera_sources=("0",), metrics_port=None, metrics_file=None,
+                 database_dir=DATABASE_DIR, capture_rate=AUTO_CAPTURE_RATE, target_fps=TARGET_FPS):
         self.root = root
+        # Camera indices, or recorded videos replayed in their place; several run one process each
+        self.camera_sources = list(camera_sources)
+        
+        # Registration: hands-free capture takes capture_rate samples per second without keypresses
+        self.auto_capture = tk.BooleanVar(value=True)
+        self.capture_rate = capture_rate
+        self.target_fps = target_fps    # frame rate the attendance loop adapts its work to hold
         self.root.title("Face Recognition Attendance System")
         self.root.geometry("1200x800")
         
-        # Initialize OpenCV face detector
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # OpenCV face detector, loaded in the background by load_models() (see cascade())
+        self.face_cascade = None
+        self.cascade_loaded = threading.Event()
         
         # Database paths
-        self.database_dir = "./student_database"
-        self.photos_dir = os.path.join(self.database_dir, "photos")
+        self.database_dir = database_dir
+        self.photos_dir = os.path.join(self.database_dir, "photos")  # legacy per-JPG gallery
         os.makedirs(self.database_dir, exist_ok=True)
-        os.makedirs(self.photos_dir, exist_ok=True)
         
-        # SQLite Database Setup
-        self.conn = sqlite3.connect(os.path.join(self.database_dir, 'attendance_system.db'))
+        # Packed face gallery; a legacy photos/ tree is imported once on first start
+        self.gallery = GalleryStore(os.path.join(self.database_dir, "gallery"))
+        if not self.gallery.exists() and os.path.isdir(self.photos_dir):
+            self.gallery.import_photos(self.photos_dir)
+        
+        # Persisted LBPH model and the manifest of the gallery it was trained on
+        self.model_path = os.path.join(self.database_dir, "lbph_model")
+        self.manifest_path = os.path.join(self.database_dir, "model_manifest.json")
+        
+        # Per-stage timings of the attendance loop, optionally served on localhost or written to a file
+        self.metrics = StageMetrics()
+        self.metrics_lines = []
+        self.metrics_overlay = False
+        self.metrics_file = metrics_file
+        self.metrics_server = MetricsServer(self.metrics, metrics_port) if metrics_port else None
+        
+        # SQLite Database Setup; attendance marks go through the writer thread's own connection
+        self.database_notes = []    # migration messages, shown once the model is ready
+        self.conn = open_database(self.database_dir, report=self.database_notes.append)
         self.cursor = self.conn.cursor()
+        self.writer = AttendanceWriter(self.database_dir, metrics=self.metrics)
         
         # Default faculties
-        self.faculties = ['Civil', 'Computer', 'Mechanical', 'Electrical', 'Agriculture']
-        self.years = [1, 2, 3, 4]
-        
-        # Create tables for students and attendance
-        self.create_student_tables()
-        self.create_attendance_tables()
+        self.faculties = list(FACULTIES)
+        self.years = list(YEARS)
         
         # LBPH data
-        self.known_faces = {}   # Will store a single reference image per person for the GUI list
-        self.label_map = {}     # name -> numeric label
-        self.id_map = {}        # numeric label -> name
-        self.recognizer = None  # LBPH recognizer instance
+        self.known_faces = {}                   # Will store a single reference image per person for the GUI list
+        self.label_map = self.gallery.label_map # name -> numeric label (owned by the gallery)
+        self.id_map = self.gallery.id_map       # numeric label -> name
+        self.recognizer = None                  # LBPHRecognizer instance
+        self.model_dirty = False
+        self.trainer = ModelTrainer(self.gallery, self.model_path, self.manifest_path)
+        self.pending_changes = []               # incremental changes made while a retrain runs
+        self.announce_training = False
+        self.engine = None                      # AttendanceEngine of the running attendance loop
         
-        # Attendance tracking
-        self.attendance_log = []
-        self.current_date = datetime.now().date()
-        self.marked_today = set()
+        # Every registered student, loaded once and kept current in memory
+        self.directory = StudentDirectory.load(self.conn, self.label_map)
         
-        # Train the recognizer with existing data
-        self.train_recognizer()
+        # Session scope: a class or roster searched first, with a shard kept ready for every class
+        self.shards = {}            # (faculty, year) -> RecognizerShard of that class
+        self.session_roster = None  # (file name, entries, RecognizerShard) of a loaded roster
         
-        # Build the GUI
+        # Attendance tracking
+        self.attendance = AttendanceStore(self.conn, self.writer)
+        self.attendance_running = False
+        
+        # Build the GUI; the models load once the window is up
         self.setup_gui()    
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(TRAIN_POLL_MS, self.poll_training)
+        self.root.after_idle(self.load_models)
     
-    def create_student_tables(self):
-        for faculty in self.faculties:
-            for year in self.years:
-                self.cursor.execute(f'''
-                CREATE TABLE IF NOT EXISTS {faculty}_Year{year}_Students (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    roll_number TEXT NOT NULL UNIQUE,
-                    registration_date DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                ''')
-        self.conn.commit()
-    
-    def create_attendance_tables(self):
-        for faculty in self.faculties:
-            for year in self.years:
-                self.cursor.execute(f'''
-                CREATE TABLE IF NOT EXISTS {faculty}_Year{year}_Attendance (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    student_name TEXT NOT NULL,
-                    student_id TEXT NOT NULL,
-                    attendance_date DATE NOT NULL,
-                    attendance_time DATETIME NOT NULL,
-                    status TEXT DEFAULT 'Absent'
-                )
-                ''')
-        self.conn.commit()
+    def load_models(self):
+        """Load the Haar cascade and the recognizer off the Tk thread, so the window is usable at once."""
+        threading.Thread(target=self._load_cascade, name="cascade-loader", daemon=True).start()
+        self.load_recognizer()
     
-    def train_recognizer(self):
+    def _load_cascade(self):
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.cascade_loaded.set()
+    
+    def cascade(self):
+        """The Haar cascade, waiting for the background load if it has not finished yet."""
+        self.cascade_loaded.wait()
+        return self.face_cascade
+    
+    def load_recognizer(self):
         """
-        Load all images from subfolders in photos_dir, update known_faces, and train the LBPH recognizer.
-        Each student's images are in a subfolder named after the student (e.g., 'John').
+        Load the persisted LBPH model in the background if the gallery is unchanged since it was
+        saved, otherwise start a full retrain (which saves a fresh model and manifest). Either way
+        poll_training() swaps the model in; until then faces are reported as Unknown.
         """
-        self.label_map.clear()
-        self.id_map.clear()
+        self.refresh_known_faces()
+        if not model_is_current(self.manifest_path, self.model_path, self.gallery):
+            self.train_recognizer()
+            return
+        
+        self.model_dirty = False
+        self.status_label.config(text="Loading model...")
+        self.trainer.load()
+    
+    def refresh_known_faces(self):
+        # One reference image per person for the Manage Database list (a view into the gallery)
+        faces = self.gallery.faces()
         self.known_faces.clear()
+        for name, row in self.gallery.first_samples().items():
+            self.known_faces[name] = faces[row]
+    
+    def save_recognizer(self, write_model=True):
+        """Persist the model and its manifest (see save_model)."""
+        self.trainer.save(self.recognizer, self.gallery.signature(), write_model)
+        self.model_dirty = False
+    
+    def train_recognizer(self):
+        """
+        Train the LBPH recognizer on every live crop in the packed gallery, in the background
+        (see ModelTrainer); poll_training() swaps the new model and known_faces in when it is
+        done. Crops are streamed in TRAIN_BATCH_SIZE batches, so memory for images stays bounded.
+        This is the full rebuild; day-to-day changes go through add_samples_to_model() and
+        remove_person_from_model().
+        """
+        # The new snapshot already contains every change made so far
+        self.pending_changes = []
+        self.trainer.request()
+    
+    def poll_training(self):
+        """Show the progress of a background retrain and swap its model in once it is done."""
+        while True:
+            try:
+                result = self.trainer.results.get_nowait()
+            except queue.Empty:
+                break
+            if result[1] != self.trainer.generation:
+                continue    # superseded
+            if result[0] == 'progress':
+                _, _, done, total = result
+                self.status_label.config(text=f"Training model... {done}/{total} images")
+            elif result[0] == 'failed':
+                # The model in use already has every change made meanwhile; nothing to replay
+                self.pending_changes = []
+                self.status_label.config(text=f"Model could not be loaded or trained ({result[2]}); "
+                                              f"use Rebuild Model to retry")
+            else:
+                _, _, recognizer, known_faces = result
+                self.swap_recognizer(recognizer, known_faces)
+        self.root.after(TRAIN_POLL_MS, self.poll_training)
+    
+    def swap_recognizer(self, recognizer, known_faces):
+        """
+        Replace the model with a freshly trained one. Changes made while it trained are replayed
+        onto it first; predictions already running finish on the old model.
+        """
+        for change in self.pending_changes:
+            recognizer = self.apply_model_change(recognizer, change)
+        self.model_dirty = bool(self.pending_changes)
+        self.pending_changes = []
+        self.recognizer = recognizer
+        if self.engine is not None:
+            self.engine.recognizer = recognizer
         
-        faces = []
-        labels = []
-        label_id = 0
+        for name in list(known_faces):
+            if name not in self.label_map:
+                del known_faces[name]
+        for name, face in self.known_faces.items():
+            if name in self.label_map:
+                known_faces.setdefault(name, face)
+        self.known_faces = known_faces
+        self.refresh_shards()
         
-        # Walk through each person's folder
-        for person_folder in os.listdir(self.photos_dir):
-            folder_path = os.path.join(self.photos_dir, person_folder)
-            if not os.path.isdir(folder_path):
-                continue
-            
-            # The folder name is considered the 'name' for LBPH label mapping
-            name = person_folder  
-            
-            # Go through all .jpg images in this folder
-            for filename in os.listdir(folder_path):
-                if filename.endswith('.jpg'):
-                    image_path = os.path.join(folder_path, filename)
-                    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-                    if img is None:
-                        continue
-                    
-                    # Create a new numeric label if needed
-                    if name not in self.label_map:
-                        self.label_map[name] = label_id
-                        self.id_map[label_id] = name
-                        label_id += 1
-                    
-                    faces.append(img)
-                    labels.append(self.label_map[name])
-            
-            # Store one reference image in self.known_faces for listing in Manage Database
-            # (e.g., the first image found in the folder)
-            if name in self.label_map and len(self.known_faces) < label_id:
-                self.known_faces[name] = img
-        
-        if faces:
-            self.recognizer = cv2.face.LBPHFaceRecognizer_create()
-            self.recognizer.train(faces, np.array(labels))
-        else:
-            self.recognizer = None
+        self.status_label.config(text="; ".join([f"Model ready ({len(self.label_map)} people)"] + self.database_notes))
+        self.database_notes = []
+        if self.announce_training:
+            self.announce_training = False
+            messagebox.showinfo("Success", f"Recognizer rebuilt for {len(self.label_map)} people.")
+    
+    def session_shard(self):
+        """RecognizerShard of the selected session, or None to search every student."""
+        if self.session_roster is not None:
+            return self.session_roster[2]
+        faculty = self.session_faculty.get()
+        year = self.session_year.get()
+        key = (None if faculty == "All" else faculty, None if year == "All" else int(year))
+        if key == (None, None):
+            return None
+        if key not in self.shards:
+            self.shards[key] = RecognizerShard(self.directory.labels_for(*key))
+        return self.shards[key]
+    
+    def session_description(self):
+        if self.session_roster is not None:
+            return f"roster {self.session_roster[0]}"
+        faculty = self.session_faculty.get()
+        year = self.session_year.get()
+        if faculty == "All" and year == "All":
+            return "all students"
+        return f"{'all faculties' if faculty == 'All' else faculty}, {'all years' if year == 'All' else 'Year ' + year}"
+    
+    def change_session(self):
+        """Faculty/year picked: drop any roster and switch a running attendance loop over at once."""
+        self.session_roster = None
+        self.apply_session()
+    
+    def apply_session(self):
+        shard = self.session_shard()
+        if self.engine is not None:
+            self.engine.shard = shard
+        students = "every" if shard is None else len(shard)
+        self.status_label.config(text=f"Session: {self.session_description()} ({students} students)")
+    
+    def load_roster(self):
+        path = filedialog.askopenfilename(title="Select Roster",
+                                          filetypes=[("Roster", "*.csv *.txt"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            entries = read_roster(path)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            messagebox.showerror("Error", f"Could not read the roster: {e}")
+            return
+        labels, unmatched = self.directory.roster_labels(entries)
+        self.session_faculty.set("All")
+        self.session_year.set("All")
+        shard = RecognizerShard(labels)
+        if self.recognizer is not None:
+            shard.sync(self.recognizer)
+        self.session_roster = (os.path.basename(path), entries, shard)
+        self.apply_session()
+        if unmatched:
+            messagebox.showwarning("Roster", f"{len(unmatched)} roster entries match no registered student: "
+                                             + ", ".join(unmatched[:10]) + ("..." if len(unmatched) > 10 else ""))
+    
+    def refresh_shards(self):
+        """
+        Rebuild the class and roster shards from the current registrations and index them against
+        the current model, so starting or switching a session never waits for one.
+        """
+        keys = {(student.faculty, int(student.year)) for student in self.directory.by_roll.values()}
+        self.shards = {key: RecognizerShard(self.directory.labels_for(*key)) for key in keys | set(self.shards)}
+        if self.session_roster is not None:
+            name, entries, _ = self.session_roster
+            self.session_roster = (name, entries, RecognizerShard(self.directory.roster_labels(entries)[0]))
+        if self.recognizer is not None:
+            for shard in self.shards.values():
+                shard.sync(self.recognizer)
+            if self.session_roster is not None:
+                self.session_roster[2].sync(self.recognizer)
+        if self.engine is not None:
+            self.engine.shard = self.session_shard()
+    
+    def rebuild_recognizer(self):
+        """Explicit full rebuild of the model from every photo on disk."""
+        self.status_label.config(text="Rebuilding recognizer...")
+        self.root.update_idletasks()
+        self.gallery.compact()
+        self.announce_training = True
+        self.train_recognizer()
+    
+    @staticmethod
+    def apply_model_change(recognizer, change):
+        """
+        Apply ('add', faces, labels, poses) or ('remove', label) to a recognizer. Returns the
+        recognizer, which is created for a first add and becomes None once nobody is left.
+        """
+        if change[0] == 'add':
+            _, faces, labels, poses = change
+            if recognizer is None:
+                recognizer = LBPHRecognizer(top_k=SEARCH_TOP_K)
+            recognizer.update(faces, labels, poses)
+        elif recognizer is not None:
+            recognizer.remove_label(change[1])
+            if recognizer.empty():
+                recognizer = None
+        return recognizer
+    
+    def add_samples_to_model(self, name, faces, poses):
+        """
+        Add freshly captured face crops (already appended to the gallery) to the existing model
+        with LBPH update(), so the cost scales with the new samples instead of the whole gallery.
+        """
+        if not faces:
+            return
+        
+        labels = np.full(len(faces), self.label_map[name], dtype=np.int32)
+        change = ('add', np.array(faces), labels, poses)
+        self.recognizer = self.apply_model_change(self.recognizer, change)
+        if self.trainer.busy():
+            self.pending_changes.append(change)
+        
+        if name not in self.known_faces:
+            self.known_faces[name] = faces[0]
+        
+        # Writing the model is proportional to the gallery, so it is deferred to shutdown.
+        # Until then the manifest on disk is stale, which safely forces a retrain after a crash.
+        self.model_dirty = True
+        self.refresh_shards()
+    
+    def remove_person_from_model(self, name):
+        """
+        Tombstone the person in the gallery and drop only their histograms from the model. Like
+        add_samples_to_model(), this changes the recognizer in place, so it is only called while
+        no attendance session is predicting with it.
+        """
+        label = self.gallery.delete_person(name)
+        if label is None:
+            return
+        self.known_faces.pop(name, None)
+        
+        change = ('remove', label)
+        self.recognizer = self.apply_model_change(self.recognizer, change)
+        if self.trainer.busy():
+            self.pending_changes.append(change)
+        self.model_dirty = True
+        self.refresh_shards()
+    
+    def on_close(self):
+        # A retrain still running is abandoned; its manifest was never written, so the next start retrains
+        if self.trainer.busy():
+            self.trainer.cancel()
+        # Flush incremental model changes so the next start can skip training
+        elif self.model_dirty:
+            self.save_recognizer()
+        # Commit any attendance marks still queued
+        self.writer.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.metrics_file:
+            self.metrics.write(self.metrics_file)
+        self.root.destroy()
     
     def setup_gui(self):
         # Configure style
@@ -164,17 +3048,38 @@ class AttendanceSystemGUI:
             ("Take Attendance", self.run_attendance),
             ("Export Attendance Log", self.export_attendance),
             ("Generate Reports", self.generate_reports),
-            ("Manage Database", self.manage_database)
+            ("Manage Database", self.manage_database),
+            ("Rebuild Model", self.rebuild_recognizer)
         ]
         
         for text, command in buttons:
             btn = ttk.Button(left_panel, text=text, command=command, style='Action.TButton')
             btn.pack(fill='x', pady=5)
         
+        # Attendance session: only this class (or roster) is searched; unknown faces fall back to everyone
+        session_frame = ttk.LabelFrame(left_panel, text="Session", padding=5)
+        session_frame.pack(fill='x', pady=(15, 0))
+        self.session_faculty = tk.StringVar(value="All")
+        self.session_year = tk.StringVar(value="All")
+        ttk.Combobox(session_frame, textvariable=self.session_faculty, values=["All"] + self.faculties,
+                     state='readonly', width=12).pack(side='left')
+        ttk.Combobox(session_frame, textvariable=self.session_year, values=["All"] + [str(year) for year in self.years],
+                     state='readonly', width=5).pack(side='left', padx=5)
+        ttk.Button(session_frame, text="Roster...", command=self.load_roster).pack(side='left')
+        for variable in (self.session_faculty, self.session_year):
+            variable.trace_add('write', lambda *args: self.change_session())
+        
         # Status display
         self.status_label = ttk.Label(left_panel, style='SubHeader.TLabel')
         self.status_label.pack(pady=20)
         
+        # Rolling stage latencies (p50 / p95 / p99) while attendance runs
+        self.metrics_label = ttk.Label(left_panel, font=('Courier', 9), justify='left')
+        self.metrics_label.pack(fill='x')
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
+        if self.metrics_file:
+            self.root.after(METRICS_EXPORT_MS, self.export_metrics)
+        
         # Right Panel - Attendance Display
         ttk.Label(right_panel, text="Attendance Records", style='Header.TLabel').pack(pady=(0, 20))
         
@@ -197,82 +3102,75 @@ class AttendanceSystemGUI:
         self.refresh_attendance_table()
         
     def setup_attendance_table(self, parent):
-        # Create Treeview with scrollbar
-        table_frame = ttk.Frame(parent)
-        table_frame.pack(fill='both', expand=True)
-
-        self.tree = ttk.Treeview(
-            table_frame, 
-            columns=('Name', 'ID', 'Faculty', 'Year', 'Time', 'Status'), 
-            show='headings'
+        # Only the visible rows exist as Treeview items; see VirtualTable
+        self.table = VirtualTable(
+            parent,
+            ('Name', 'ID', 'Faculty', 'Year', 'Time', 'Status'),
+            {'Name': 100, 'ID': 80, 'Faculty': 80, 'Year': 50, 'Time': 100, 'Status': 80},
+            self.format_attendance_row
         )
-
-        # Configure columns
-        self.tree.heading('Name', text='Name')
-        self.tree.heading('ID', text='ID')
-        self.tree.heading('Faculty', text='Faculty')
-        self.tree.heading('Year', text='Year')
-        self.tree.heading('Time', text='Time')
-        self.tree.heading('Status', text='Status')
-
-        self.tree.column('Name', width=100)
-        self.tree.column('ID', width=80)
-        self.tree.column('Faculty', width=80)
-        self.tree.column('Year', width=50)
-        self.tree.column('Time', width=100)
-        self.tree.column('Status', width=80)
-
-        # Add scrollbar
-        scrollbar = ttk.Scrollbar(table_frame, orient='vertical', command=self.tree.yview)
-        self.tree.configure(yscrollcommand=scrollbar.set)
-
-        # Pack elements
-        self.tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-
+        self.table_date = None
         
+        # Marks reach the table through a queue drained on the Tk event loop
+        self.table_updates = queue.Queue()
+        self.root.after(TABLE_DRAIN_MS, self.drain_table_updates)
+    
+    def format_attendance_row(self, entry):
+        student = self.directory.get(entry['name'])
+        return (
+            entry['name'],
+            student.roll_number if student else 'N/A',
+            student.faculty if student else 'N/A',
+            student.year if student else 'N/A',
+            entry['timestamp'].strftime('%H:%M:%S'),
+            'Present'
+        )
+    
     def refresh_attendance_table(self):
-        # Clear existing items
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        
         # Get selected date
         selected_date = datetime.strptime(self.date_var.get(), '%Y-%m-%d').date()
         
-        # Fetch student details from the database
-        student_details = {}
-        for faculty in self.faculties:
-            for year in self.years:
-                self.cursor.execute(f'''
-                    SELECT name, roll_number, ? AS faculty, ? AS year 
-                    FROM {faculty}_Year{year}_Students
-                ''', (faculty, year))
-                for row in self.cursor.fetchall():
-                    student_details[row[0]] = {
-                        'ID': row[1],
-                        'Faculty': row[2],
-                        'Year': row[3]
-                    }
-        
-        # Filter attendance for selected date
-        day_attendance = [log for log in self.attendance_log if log['date'] == selected_date]
-        
-        # Sort by time
-        day_attendance.sort(key=lambda x: x['timestamp'])
-        
-        # Add to table
-        for entry in day_attendance:
-            student_info = student_details.get(entry['name'], {})
-            self.tree.insert('', 'end', values=(
-                entry['name'],
-                student_info.get('ID', 'N/A'),
-                student_info.get('Faculty', 'N/A'),
-                student_info.get('Year', 'N/A'),
-                entry['timestamp'].strftime('%H:%M:%S'),
-                'Present'
-            ))    
+        # The table keeps its own copy of the day's list; live marks are appended by drain_table_updates
+        self.table_date = selected_date
+        self.table.set_rows(list(self.attendance.day(selected_date)))
+    
+    def drain_table_updates(self):
+        """
+        Append queued marks for the displayed date in one render and show any commit failure of
+        the writer, then reschedule.
+        """
+        new_rows = []
+        while True:
+            try:
+                entry = self.table_updates.get_nowait()
+            except queue.Empty:
+                break
+            if entry['date'] == self.table_date:
+                new_rows.append(entry)
+        if new_rows:
+            self.table.append(new_rows)
+        while not self.writer.errors.empty():
+            self.status_label.config(text=self.writer.errors.get_nowait())
+        self.root.after(TABLE_DRAIN_MS, self.drain_table_updates)
+    
+    def refresh_metrics(self):
+        """Recompute the percentiles shown in the status panel and the overlay, then reschedule."""
+        if self.metrics.samples:
+            self.metrics_lines = self.metrics.summary_lines()
+            header = f"{'stage':<16} {'p50':>6} {'p95':>6} {'p99':>6}"
+            self.metrics_label.config(text="\n".join([self.metrics_lines[0], header] + self.metrics_lines[1:]))
+        self.root.after(METRICS_REFRESH_MS, self.refresh_metrics)
+    
+    def export_metrics(self):
+        try:
+            self.metrics.write(self.metrics_file)
+        except OSError as e:
+            print(f"Could not write metrics to {self.metrics_file}: {e}")
+        self.root.after(METRICS_EXPORT_MS, self.export_metrics)
     
     def show_calendar(self):
+        from tkcalendar import Calendar
+        
         cal_window = tk.Toplevel(self.root)
         cal_window.title("Select Date")
         cal = Calendar(cal_window, selectmode='day')
@@ -305,33 +3203,39 @@ class AttendanceSystemGUI:
         db_window.title("Manage Database")
         db_window.geometry("600x400")
         
-        # Create Treeview for registered users
-        self.tree = ttk.Treeview(db_window, columns=('Name', 'Registration Date'), show='headings')
-        self.tree.heading('Name', text='Name')
-        self.tree.heading('Registration Date', text='Registration Date')
-        self.tree.pack(fill='both', expand=True, padx=20, pady=20)
+        # Create Treeview for registered users (separate from the attendance table)
+        self.people_tree = ttk.Treeview(db_window, columns=('Name', 'Registration Date'), show='headings')
+        self.people_tree.heading('Name', text='Name')
+        self.people_tree.heading('Registration Date', text='Registration Date')
+        self.people_tree.pack(fill='both', expand=True, padx=20, pady=20)
         
         # Populate with registered users from self.known_faces
         for name in self.known_faces.keys():
-            self.tree.insert('', 'end', values=(name, 'N/A'))
+            student = self.directory.get(name)
+            self.people_tree.insert('', 'end', values=(name, student.registration_date if student else 'N/A'))
         
         # Control buttons
         btn_frame = ttk.Frame(db_window)
         btn_frame.pack(fill='x', padx=20, pady=10)
         
         ttk.Button(btn_frame, text="Delete Selected", 
-                  command=lambda: self.delete_person(self.tree.selection())).pack(side='left', padx=5)
+                  command=lambda: self.delete_person(self.people_tree.selection())).pack(side='left', padx=5)
         ttk.Button(btn_frame, text="Update Photo", 
-                  command=lambda: self.update_person_photo(self.tree.selection())).pack(side='left', padx=5)
+                  command=lambda: self.update_person_photo(self.people_tree.selection())).pack(side='left', padx=5)
     
     def delete_person(self, selection):
+        # The recognizer and its shards are updated in place, which the attendance loop's
+        # recognize thread must not see halfway
+        if self.attendance_running:
+            messagebox.showwarning("Warning", "Stop taking attendance before deleting a person")
+            return
         if not selection:
             messagebox.showwarning("Warning", "Please select a person to delete")
             return
         
-        name = self.tree.item(selection[0])['values'][0]
+        name = self.people_tree.item(selection[0])['values'][0]
         if messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete {name}?"):
-            # Remove entire folder for this person
+            # Remove any legacy photo folder for this person
             person_folder = os.path.join(self.photos_dir, name)
             if os.path.exists(person_folder):
                 try:
@@ -340,24 +3244,19 @@ class AttendanceSystemGUI:
                     messagebox.showerror("Error", f"Failed to delete folder: {e}")
                     return
             
-            # Remove from known_faces
-            if name in self.known_faces:
-                del self.known_faces[name]
-            
             # Remove from Treeview
-            self.tree.delete(selection[0])
+            self.people_tree.delete(selection[0])
             
-            # Remove from the database (all faculties/years)
+            # Deactivate rather than delete, so their attendance history stays in reports
             try:
-                for faculty in self.faculties:
-                    for year in self.years:
-                        self.cursor.execute(f"DELETE FROM {faculty}_Year{year}_Students WHERE name = ?", (name,))
+                self.cursor.execute("UPDATE students SET active = 0 WHERE name = ? AND active = 1", (name,))
                 self.conn.commit()
+                self.directory.remove(name)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to delete {name} from database: {e}")
             
-            # Re-train recognizer
-            self.train_recognizer()
+            # Drop this person's crops from the gallery and histograms from the recognizer
+            self.remove_person_from_model(name)
             
             messagebox.showinfo("Success", f"Deleted {name} from database")
     
@@ -366,46 +3265,48 @@ class AttendanceSystemGUI:
             messagebox.showwarning("Warning", "Please select a person to update")
             return
         
-        name = self.tree.item(selection[0])['values'][0]
+        name = self.people_tree.item(selection[0])['values'][0]
         # Capture more samples and store them in the same folder
         self.capture_face(name, update=True)
     
     def generate_daily_report(self):
+        import pandas as pd
+        
         selected_date = datetime.strptime(self.date_var.get(), '%Y-%m-%d').date()
-        df = pd.DataFrame([log for log in self.attendance_log if log['date'] == selected_date])
-        if df.empty:
+        self.writer.flush()
+        log = self.attendance.day(selected_date)
+        if not log:
             messagebox.showinfo("No Data", "No attendance records found for the selected date.")
             return
         
+        report = attendance_report(self.conn, selected_date, selected_date + timedelta(days=1))
+        report['Log'] = pd.DataFrame(log)
         os.makedirs("./Reports", exist_ok=True)
         filename = f".//Reports//daily_report_{selected_date.strftime('%Y%m%d')}.xlsx"
-        df.to_excel(filename, index=False)
+        write_report(report, filename)
         messagebox.showinfo("Success", f"Daily report exported to {filename}")
     
     def generate_monthly_report(self):
-        selected_month = datetime.strptime(self.date_var.get(), '%Y-%m').date()  # Format: YYYY-MM
-        month_start = selected_month.replace(day=1)
+        # The month of the selected date
+        selected_date = datetime.strptime(self.date_var.get(), '%Y-%m-%d').date()
+        month_start = selected_date.replace(day=1)
         next_month_start = (month_start + timedelta(days=31)).replace(day=1)
         
-        # Filter attendance logs for the selected month
-        monthly_logs = [
-            log for log in self.attendance_log 
-            if month_start <= log['date'] < next_month_start
-        ]
-        if not monthly_logs:
+        self.writer.flush()
+        report = attendance_report(self.conn, month_start, next_month_start)
+        if not report['Rollup']['Marks'].sum():
             messagebox.showinfo("No Data", "No attendance records found for the selected month.")
             return
         
-        df = pd.DataFrame(monthly_logs)
         os.makedirs("./Reports", exist_ok=True)
         filename = f".//Reports//monthly_report_{month_start.strftime('%Y%m')}.xlsx"
-        df.to_excel(filename, index=False)
+        write_report(report, filename)
         messagebox.showinfo("Success", f"Monthly report exported to {filename}")
     
     def register_new_person(self):
         register_window = tk.Toplevel(self.root)
         register_window.title("Register New Person")
-        register_window.geometry("400x300")
+        register_window.geometry("400x330")
         
         ttk.Label(register_window, text="Enter Name:").pack(pady=5)
         name_entry = ttk.Entry(register_window, font=('Arial', 12))
@@ -436,25 +3337,24 @@ class AttendanceSystemGUI:
                 return
             
             # Check for duplicate roll number in the same faculty and year
-            self.cursor.execute(f'''
-                SELECT * FROM {faculty}_Year{year}_Students 
-                WHERE roll_number = ?
-            ''', (student_id,))
-            
-            if self.cursor.fetchone():
+            if self.directory.roll_exists(faculty, year, student_id):
                 messagebox.showerror("Error", f"Roll number {student_id} already exists")
                 return
             
-            # Insert student details into specific faculty and year table
-            self.cursor.execute(f'''
-                INSERT INTO {faculty}_Year{year}_Students 
-                (name, roll_number) VALUES (?, ?)
-            ''', (name, student_id))
+            # Insert student details with their faculty and year
+            self.cursor.execute('''
+                INSERT INTO students 
+                (name, roll_number, faculty, year) VALUES (?, ?, ?, ?)
+            ''', (name, student_id, faculty, year))
             self.conn.commit()
+            self.cursor.execute("SELECT registration_date FROM students WHERE id = ?", (self.cursor.lastrowid,))
+            self.directory.add(Student(self.cursor.lastrowid, name, student_id, faculty, int(year),
+                                       self.cursor.fetchone()[0], self.label_map.get(name)))
             
             register_window.destroy()
             self.capture_face(name, student_id, faculty, year)
         
+        ttk.Checkbutton(register_window, text="Hands-free capture", variable=self.auto_capture).pack(pady=5)
         ttk.Button(register_window, text="Start Capture", command=start_capture).pack(pady=10)
     
     '''def capture_face(self, name, student_id=None, faculty=None, year=None, update=False):
@@ -514,104 +3414,132 @@ class AttendanceSystemGUI:
                 messagebox.showinfo("Success", f"Successfully updated photos for {name}")'''
     def capture_face(self, name, student_id=None, faculty=None, year=None, update=False):
         
-        '''Capture multiple face samples for a person and store them as separate cropped images.
+        '''Capture multiple face samples for a person and append the cropped images to the gallery.
         The capture process guides the user through different variations (e.g., neutral, smiling, head left/right, head up/down)
-        and saves only the cropped face region from each frame.
+        and saves only the cropped face region from each frame. In hands-free mode (self.auto_capture)
+        a qualifying crop is taken every 1 / capture_rate seconds instead of on each 'c' press.
         '''
-        # Create folder for the person (you can further structure with faculty/year if needed)
-        person_folder = os.path.join(self.photos_dir, name)
-        os.makedirs(person_folder, exist_ok=True)
+        if self.attendance_running:
+            messagebox.showwarning("Warning", "Stop taking attendance before capturing faces")
+            return
         
         # Define variations with prompts and required sample counts for each variation.
+        variations = CAPTURE_VARIATIONS
+        auto = self.auto_capture.get()
+        prompt_seconds = AUTO_CAPTURE_PROMPT_SECONDS if auto else 3
         
-        variations = [
-            {"prompt": "Look straight ahead", "samples": 5},
-            {"prompt": "Smile naturally", "samples": 5},
-            {"prompt": "Turn your head slightly to the left", "samples": 5},
-            {"prompt": "Turn your head slightly to the right", "samples": 5},
-            {"prompt": "Tilt you head slightly upward", "samples": 5},
-            {"prompt": "Tilt your head slightly downward", "samples": 5},
-            {"prompt": "Tilt your head slightly towards left", "samples": 5},
-            {"prompt": "Tilt your head slightly towards right", "samples": 5},
-            {"prompt": "Make eyes wide open", "samples": 5},
-            {"prompt": "Make eyes slightly squinted", "samples": 5},
-            {"prompt": "Move little close to your camera", "samples": 5},
-            {"prompt": "Move little away from your camera", "samples": 5}
-        ]
-        
+        started = time.monotonic()
         total_samples = 0
-        cap = cv2.VideoCapture(0)
+        new_faces = []       # crops captured in this session, fed to the recognizer incrementally
+        new_poses = []
+        label = self.gallery.label_for(name)
+        self.directory.set_label(name, label)
+        # The attendance distance band would drop the close-up of the "Move little close" pose;
+        # faces too small to register are refused by SampleQuality instead
+        detector = FaceDetector(self.cascade(), size_bounds=None)
         
-        # Loop through each variation
-        for variation in variations:
-            prompt_text = variation["prompt"]
-            samples_needed = variation["samples"]
-            captured = 0
-
-            # Display prompt for a few seconds to allow the user to adjust their pose
-            prompt_start_time = cv2.getTickCount()
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    continue
-                cv2.putText(frame, prompt_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.putText(frame, "Get ready...", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.imshow('Register Face', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return
-                elapsed = (cv2.getTickCount() - prompt_start_time) / cv2.getTickFrequency()
-                if elapsed > 3:
-                    break
+        # Blurry, badly lit, small and near-duplicate crops are refused, so the student retakes them
+        quality = SampleQuality()
+        if update and self.gallery.count:
+            stored = self.gallery.faces()[self.gallery.index()['label'] == label]
+            if len(stored):
+                quality.keep(label, quality.histograms(stored))
+        rejected = None      # (reason, time) of the last refused crop, shown for a moment
+        preview = None       # thumbnail of the last saved crop, drawn into the corner of the frame
+        last_capture = 0.0
+        
+        # Gallery appends run on one background thread (in order, the store is append-only) so
+        # disk writes never stall the camera loop
+        from concurrent.futures import ThreadPoolExecutor
+        writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gallery-writer")
+        pending_writes = []
+        cap = open_source(self.camera_sources[0])
+        
+        try:
+            # Loop through each variation
+            for pose, variation in enumerate(variations):
+                prompt_text = variation["prompt"]
+                samples_needed = variation["samples"]
+                captured = 0
 
-            # Capture samples for the current variation
-            while captured < samples_needed:
-                ret, frame = cap.read()
-                if not ret:
-                    continue
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
-                
-                # Draw rectangles around detected faces for visual feedback
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                
-                cv2.putText(frame, prompt_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.putText(frame, f"Capturing {captured+1}/{samples_needed} for this pose", 
-                            (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.putText(frame, "Press 'c' to capture", (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
-                cv2.imshow('Register Face', frame)
-                
-                key = cv2.waitKey(1) & 0xFF
-                if key == ord('c') and len(faces) > 0:
-                    # Crop the first detected face from the gray image
-                    x, y, w, h = faces[0]
-                    cropped_face = gray[y:y+h, x:x+w]
-                    cropped_face = cv2.resize(cropped_face, (200, 200))
+                # Display prompt for a few seconds to allow the user to adjust their pose
+                prompt_start_time = cv2.getTickCount()
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        continue
+                    cv2.putText(frame, prompt_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    cv2.putText(frame, "Get ready...", (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    cv2.imshow('Register Face', frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        return
+                    elapsed = (cv2.getTickCount() - prompt_start_time) / cv2.getTickFrequency()
+                    if elapsed > prompt_seconds:
+                        break
+
+                # Capture samples for the current variation
+                while captured < samples_needed:
+                    ret, frame = cap.read()
+                    if not ret:
+                        continue
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    faces = detector.detect(gray)
                     
-                    # Show the cropped face briefly so the user can see what is being saved
-                    cv2.imshow("Cropped Face", cropped_face)
-                    cv2.waitKey(300)  # Display for 300 milliseconds
-                    cv2.destroyWindow("Cropped Face")
+                    # Draw rectangles around detected faces for visual feedback
+                    for (x, y, w, h) in faces:
+                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
                     
-                    total_samples += 1
-                    captured += 1
-                    file_name = f"{name}_{total_samples}.jpg"  # Use student_id to ensure unique filenames
-                    file_path = os.path.join(person_folder, file_name)
-                    cv2.imwrite(file_path, cropped_face)
+                    cv2.putText(frame, prompt_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    cv2.putText(frame, f"Capturing {captured+1}/{samples_needed} for this pose", 
+                                (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    cv2.putText(frame, "Hold still" if auto else "Press 'c' to capture",
+                                (10, 90), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    if rejected is not None and time.monotonic() - rejected[1] < 1.5:
+                        cv2.putText(frame, f"Not saved ({rejected[0]}), please try again", (10, 120),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
                     
-                elif key == ord('q'):
-                    cap.release()
-                    cv2.destroyAllWindows()
-                    return
-
-        cap.release()
-        cv2.destroyAllWindows()
+                    # The last saved crop is shown inline instead of in a window that blocks the loop
+                    if preview is not None:
+                        size = preview.shape[0]
+                        frame[-size - 10:-10, -size - 10:-10] = cv2.cvtColor(preview, cv2.COLOR_GRAY2BGR)
+                    cv2.imshow('Register Face', frame)
+                    
+                    key = cv2.waitKey(1) & 0xFF
+                    if key == ord('q'):
+                        return
+                    now = time.monotonic()
+                    due = now - last_capture >= 1.0 / self.capture_rate if auto else key == ord('c')
+                    if due and len(faces) > 0:
+                        # Crop the first detected face from the gray image
+                        x, y, w, h = faces[0]
+                        cropped_face = gray[y:y+h, x:x+w]
+                        cropped_face = cv2.resize(cropped_face, (200, 200))
+                        reason = quality.consider(label, cropped_face, face_width=w)
+                        if reason is not None:
+                            rejected = (reason, now)
+                            continue
+                        
+                        last_capture = now
+                        preview = cv2.resize(cropped_face, (frame.shape[0] // 4, frame.shape[0] // 4))
+                        total_samples += 1
+                        captured += 1
+                        pending_writes.append(writes.submit(self.gallery.append, name, [cropped_face], [pose]))
+                        new_faces.append(cropped_face)
+                        new_poses.append(pose)
+        finally:
+            cap.release()
+            cv2.destroyAllWindows()
+            writes.shutdown(wait=True)
+            failed = [future.exception() for future in pending_writes if future.exception() is not None]
+            if failed:
+                messagebox.showerror("Error", f"Could not save {len(failed)} of the captured images: {failed[0]}")
+            
+            # The captured crops go into the model straight away, before any dialog is shown
+            self.add_samples_to_model(name, new_faces, new_poses)
+            self.status_label.config(text=f"Captured {total_samples} images of {name} "
+                                          f"in {time.monotonic() - started:.0f} s")
         
         if total_samples > 0:
-            # Re-train recognizer after new samples have been added
-            self.train_recognizer()
             if not update:
                 messagebox.showinfo("Success", f"Successfully registered {name} with {total_samples} images.")
             else:
@@ -619,88 +3547,139 @@ class AttendanceSystemGUI:
                 
     
     def run_attendance(self):
-        self.status_label.config(text="Taking attendance... Press 'q' to quit")
-        cap = cv2.VideoCapture(0)
+        if self.attendance_running:
+            return
+        if len(self.camera_sources) > 1:
+            self.run_multi_camera_attendance()
+            return
+        self.attendance_running = True
+        self.status_label.config(text="Taking attendance... Press 'q' to quit, 'm' for the performance overlay")
+        cap = open_source(self.camera_sources[0])
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-        presence_duration = {}  # Track recognition duration for each person
-        required_frames = 30 # ~1 seconds at 60 FPS (adjust as needed)
+        # Faces are tracked across frames; each track is recognized on its first frame and then
+        # re-checked every TRACK_RECHECK_SECONDS, voting on its name over time
+        engine = AttendanceEngine(self.cascade(), self.recognizer, self.id_map, metrics=self.metrics,
+                                  shard=self.session_shard())
+        self.engine = engine    # a retrain finishing during the session is swapped into it
+        tracker = FaceTracker()
+        detector = FaceDetector(self.cascade(), metrics=self.metrics)
+        scheduler = (FrameScheduler(detector, tracker, engine, self.target_fps, metrics=self.metrics)
+                     if self.target_fps else None)
+        pipeline = AttendancePipeline(
+            cap,
+            detector.detect,
+            lambda gray, faces, now: engine.recognize_faces(tracker, gray, faces, now),
+            metrics=self.metrics,
+            stop_at_end=not str(self.camera_sources[0]).isdigit(),
+            scheduler=scheduler
+        )
+        pipeline.start()
 
+        # Display and attendance recording stay on the Tk thread, which owns the SQLite connection
+        closed = False
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                continue
+            finished = pipeline.finished.is_set()
+            result = pipeline.results.get(timeout=0.02)
+            if result is not None:
+                frame, annotations = result
+                start = time.perf_counter()
+                draw_annotations(frame, annotations, self.attendance.is_marked)
+                if self.metrics_overlay:
+                    StageMetrics.draw(frame, self.metrics_lines)
+                drawn = time.perf_counter()
+                cv2.imshow('Attendance System', frame)
+                self.metrics.record('draw', drawn - start)
+                self.metrics.record('imshow', time.perf_counter() - drawn)
+                self.metrics.tick()
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.3, 5)
+            while not pipeline.events.empty():
+                name = pipeline.events.get_nowait()
+                if not self.attendance.is_marked(name):
+                    start = time.perf_counter()
+                    self.mark_attendance(name)
+                    self.metrics.record('mark', time.perf_counter() - start)
 
-            for (x, y, w, h) in faces:
-                face = gray[y:y+h, x:x+w]
-                face_resized = cv2.resize(face, (200, 200))
-                recognized_name = "Unknown"
-
-                if self.recognizer is not None:
-                    label, confidence = self.recognizer.predict(face_resized)
-                    if confidence < 60:  # Lower = better match; adjust threshold as needed
-                        recognized_name = self.id_map.get(label, "Unknown")
-
-                # Update presence duration
-                if recognized_name != "Unknown":
-                    presence_duration[recognized_name] = presence_duration.get(recognized_name, 0) + 1
-                    # Mark attendance if recognized for required_frames
-                    if presence_duration[recognized_name] >= required_frames and recognized_name not in self.marked_today:
-                        self.mark_attendance(recognized_name)
-                else:
-                    # Reset durations for unrecognized faces
-                    for nm in list(presence_duration.keys()):
-                        if nm not in self.marked_today:
-                            presence_duration[nm] = 0
-
-                # Draw rectangle and display name/status
-                color = (0, 255, 0) if recognized_name != "Unknown" else (0, 0, 255)
-                cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
-                status = "Marked" if recognized_name in self.marked_today else "Not Marked"
-                cv2.putText(frame, f"{recognized_name} - {status}",
-                            (x, y-10), cv2.FONT_HERSHEY_SIMPLEX,
-                            0.6, color, 2)
-
-            cv2.imshow('Attendance System', frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('q') or finished:
+                break
+            if key == ord('m'):
+                self.metrics_overlay = not self.metrics_overlay
+            self.metrics.set_gauge('dropped_frames', pipeline.frames.dropped + pipeline.detections.dropped)
+            # Keep the main window responsive while the camera window is open
+            try:
+                self.root.update()
+            except tk.TclError:
+                closed = True   # the main window was closed
                 break
 
+        pipeline.stop()
         cap.release()
         cv2.destroyAllWindows()
-        self.status_label.config(text="Ready")
+        self.engine = None
+        self.attendance_running = False
+        if closed:
+            return
+        self.status_label.config(text=f"Ready (detection ran at {detector.fps():.1f} FPS)")
 
 
+    def run_multi_camera_attendance(self):
+        """
+        One worker process and window per camera (see MultiCameraAttendance). Names confirmed by
+        any camera are merged here and recorded once through the writer.
+        """
+        # Workers memory-map the saved model, so it must include every change made in this session
+        if self.trainer.busy():
+            messagebox.showwarning("Warning", "The model is still training; try again when it is ready")
+            return
+        if self.model_dirty or not os.path.exists(os.path.join(self.model_path, 'prototypes.npy')):
+            self.save_recognizer()
+        
+        self.attendance_running = True
+        self.status_label.config(text=f"Taking attendance on {len(self.camera_sources)} cameras... "
+                                      f"Press 'q' in any camera window to quit")
+        marked = {entry['name'] for entry in self.attendance.today()}
+        shard = self.session_shard()
+        cameras = MultiCameraAttendance(self.camera_sources, self.model_path, self.id_map, marked,
+                                        session_labels=None if shard is None else shard.labels.tolist(),
+                                        target_fps=self.target_fps)
+        cameras.start()
+        closed = False
+        while cameras.active():
+            for name, source, timestamp in cameras.poll(timeout=0.02):
+                if not self.attendance.is_marked(name):
+                    self.mark_attendance(name)
+            try:
+                self.root.update()
+            except tk.TclError:
+                closed = True   # the main window was closed
+                break
+        cameras.stop()
+        self.attendance_running = False
+        # on_close has already shut the writer down along with the window
+        if closed:
+            return
+        for name, source, timestamp in cameras.poll():
+            if not self.attendance.is_marked(name):
+                self.mark_attendance(name)
+        
+        frames = sum(frames for frames, seconds in cameras.stats.values())
+        seconds = max([seconds for frames, seconds in cameras.stats.values()] or [0])
+        rate = frames / seconds if seconds else 0.0
+        self.status_label.config(text=f"Ready ({len(self.camera_sources)} cameras, {rate:.1f} frames/s in total)")
+    
     def mark_attendance(self, name):
-        # Retrieve student details
-        for faculty in self.faculties:
-            for year in self.years:
-                self.cursor.execute(f'''
-                    SELECT roll_number FROM {faculty}_Year{year}_Students 
-                    WHERE name = ?
-                ''', (name,))
-                result = self.cursor.fetchone()
-                
-                if result:
-                    student_id = result[0]
-                    timestamp = datetime.now()
-                    
-                    # Insert attendance record
-                    self.cursor.execute(f'''
-                        INSERT INTO {faculty}_Year{year}_Attendance 
-                        (student_name, student_id, attendance_date, attendance_time) 
-                        VALUES (?, ?, ?, ?)
-                    ''', (name, student_id, timestamp.date(), timestamp))
-                    self.conn.commit()
-                    break
-
-        self.attendance_log.append({
-            'name': name,
-            'timestamp': timestamp,
-            'date': timestamp.date()
-        })
-        self.marked_today.add(name)
+        student = self.directory.get(name)
+        if student is None:
+            self.status_label.config(text=f"{name} is not registered in any class")
+            return
+        
+        # Added to today's bucket first (loading it flushes the writer), then queued for the
+        # writer thread; the frame loop never waits for a commit
+        timestamp = datetime.now()
+        self.attendance.add(name, timestamp)
+        self.writer.submit(student.student_id, timestamp)
+        self.table_updates.put({'name': name, 'timestamp': timestamp, 'date': timestamp.date()})
         self.status_label.config(text=f"Marked attendance for {name}")
     
     
@@ -712,8 +3691,7 @@ class AttendanceSystemGUI:
         text_widget = tk.Text(view_window, font=('Arial', 12), wrap=tk.WORD)
         text_widget.pack(expand=True, fill='both', padx=20, pady=20)
         
-        today = datetime.now().date()
-        today_attendance = [log for log in self.attendance_log if log['date'] == today]
+        today_attendance = self.attendance.today()
         
         if today_attendance:
             text_widget.insert('end', "Today's Attendance:\n\n")
@@ -727,31 +3705,407 @@ class AttendanceSystemGUI:
 
     def export_attendance(self):
         filename = f"attendance_log_{datetime.now().strftime('%Y%m%d')}.csv"
+        self.writer.flush()
         
-        # Collect attendance from all faculty and year tables
-        all_attendance = []
-        for faculty in self.faculties:
-            for year in self.years:
-                self.cursor.execute(f'''
-                    SELECT * FROM {faculty}_Year{year}_Attendance
-                ''')
-                all_attendance.extend(self.cursor.fetchall())
-        
-        if not all_attendance:
+        # Streamed in chunks straight from SQLite; see the export command for filters and formats
+        rows = export_attendance_rows(self.conn, filename)
+        if not rows:
+            os.remove(filename)
             messagebox.showinfo("No Data", "No attendance records to export.")
             return
-        
-        df = pd.DataFrame(all_attendance, columns=['ID', 'Name', 'Student ID', 'Date', 'Time', 'Status'])
-        df.to_csv(filename, index=False)
         messagebox.showinfo("Success", f"Attendance exported to {filename}")
 
     def __del__(self):
         if hasattr(self, 'conn'):
             self.conn.close()
 
+def import_gallery_command(args):
+    gallery = GalleryStore(os.path.join(args.database, "gallery"))
+    if gallery.count:
+        print(f"Gallery already holds {gallery.count} crops; new photos are appended.")
+    people, crops = gallery.import_photos(
+        args.photos or os.path.join(args.database, "photos"),
+        progress=lambda person, total: print(f"  {person}: {total} crops so far"))
+    print(f"Imported {crops} crops for {people} people into {gallery.gallery_dir}")
+    print("The recognizer is retrained from the gallery on the next start.")
+
+def prune_command(args):
+    """
+    Drop stored samples that capture_face would now refuse: blurry, badly exposed and
+    near-duplicate crops. Works on the packed gallery, or on a legacy photos/ tree with --photos.
+    """
+    quality = SampleQuality()
+    if args.photos:
+        people = sorted(person for person in os.listdir(args.photos)
+                        if os.path.isdir(os.path.join(args.photos, person)))
+        files = {person: sorted(filename for filename in os.listdir(os.path.join(args.photos, person))
+                                if filename.lower().endswith(IMAGE_EXTENSIONS)) for person in people}
+        
+        def students():
+            for label, person in enumerate(people):
+                crops = [cv2.imread(os.path.join(args.photos, person, filename), cv2.IMREAD_GRAYSCALE)
+                         for filename in files[person]]
+                crops = [crop if crop is None or crop.shape == (FACE_SIZE, FACE_SIZE)
+                         else cv2.resize(crop, (FACE_SIZE, FACE_SIZE)) for crop in crops]
+                unreadable = [filename for filename, crop in zip(files[person], crops) if crop is None]
+                if unreadable:
+                    print(f"  {person}: skipping unreadable {', '.join(unreadable)}")
+                    files[person] = [filename for filename, crop in zip(files[person], crops) if crop is not None]
+                    crops = [crop for crop in crops if crop is not None]
+                yield label, np.array(crops).reshape(-1, FACE_SIZE, FACE_SIZE), np.full(len(crops), -1)
+        
+        total = sum(len(names) for names in files.values())
+    else:
+        gallery = GalleryStore(os.path.join(args.database, "gallery"))
+        index = gallery.index()
+        live = gallery.live_mask()
+        rows_by_label = {label: np.flatnonzero(live & (index['label'] == label))
+                         for label in np.unique(index['label'][live]).tolist()}
+        
+        def students():
+            faces = gallery.faces()
+            for label, rows in rows_by_label.items():
+                yield label, np.array(faces[rows]), index['pose'][rows]
+        
+        total = int(live.sum())
+    if not total:
+        print("No samples to prune.")
+        return
+    
+    keep, evaluation = prune_samples(students(), total, quality, queries=args.evaluate, seed=args.seed)
+    total = sum(len(student_keep) for student_keep in keep)     # without unreadable photos
+    kept = int(sum(student_keep.sum() for student_keep in keep))
+    if args.photos:
+        sizes = [os.path.getsize(os.path.join(args.photos, person, filename))
+                 for person in people for filename in files[person]]
+        stored_bytes = sum(sizes)
+        kept_bytes = sum(np.array(sizes)[np.concatenate(keep)]) if sizes else 0
+    else:
+        stored_bytes = total * gallery.face_bytes
+        kept_bytes = kept * gallery.face_bytes
+    print(f"{total} samples, {kept} kept, {total - kept} dropped "
+          f"({100 * (total - kept) / total:.1f}%, {(stored_bytes - kept_bytes) / 2**20:.1f} MB)")
+    if evaluation:
+        print(f"Held-out queries: {evaluation['queries']}")
+        print(f"{'':>8} {'samples':>9} {'p50 ms':>8} {'p95 ms':>8} {'accuracy':>9}")
+        for name in ('before', 'after'):
+            row = evaluation[name]
+            print(f"{name:>8} {row['samples']:>9} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['accuracy']:>9.3f}")
+    if args.dry_run or kept == total:
+        return
+    
+    if args.photos:
+        for person, student_keep in zip(people, keep):
+            for filename, keep_file in zip(files[person], student_keep):
+                if not keep_file:
+                    os.remove(os.path.join(args.photos, person, filename))
+    else:
+        mask = np.zeros(gallery.count, dtype=bool)
+        for rows, student_keep in zip(rows_by_label.values(), keep):
+            mask[rows[student_keep]] = True
+        gallery.compact(keep=mask)
+        print("The recognizer is retrained from the gallery on the next start.")
+
+def search_report_command(args):
+    """Replay perturbed gallery crops through the exhaustive and two-stage searches."""
+    gallery = GalleryStore(os.path.join(args.database, "gallery"))
+    model_path = os.path.join(args.database, "lbph_model")
+    if not os.path.exists(os.path.join(model_path, 'labels.npy')):
+        print("No trained model found; start the application once to train it.")
+        return
+    recognizer = LBPHRecognizer.load(model_path)
+    
+    # Shifted, noisy copies of random gallery crops stand in for live camera crops
+    rng = np.random.default_rng(args.seed)
+    live_rows = np.flatnonzero(gallery.live_mask())
+    rows = np.sort(rng.choice(live_rows, size=min(args.samples, len(live_rows)), replace=False))
+    faces = gallery.faces()
+    queries = []
+    for row in rows:
+        dx, dy = rng.integers(-4, 5, size=2)
+        shifted = np.roll(np.roll(faces[row], dy, axis=0), dx, axis=1).astype(np.int16)
+        noisy = shifted + rng.integers(-8, 9, size=shifted.shape)
+        queries.append(np.clip(noisy, 0, 255).astype(np.uint8))
+    queries = np.array(queries)
+    
+    print(f"{len(queries)} queries against {recognizer.count} samples of "
+          f"{recognizer.student_count()} students ({recognizer.prototype_count} prototypes)")
+    print(f"{'top_k':>6} {'agreement':>10} {'max dconf':>10} {'ms/face':>9} {'exh ms/face':>12} {'speedup':>8}")
+    for row in search_report(recognizer, queries, args.top_k):
+        print(f"{row['top_k']:>6} {row['agreement']:>10.3f} {row['max_confidence_delta']:>10.3f} "
+              f"{row['ms_per_face']:>9.1f} {row['exhaustive_ms_per_face']:>12.1f} {row['speedup']:>8.1f}")
+
+def open_source(source):
+    """cv2.VideoCapture for a camera index ("0"), a video file, a file:// URL or a stream URL."""
+    source = str(source)
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    if source.startswith('file://'):
+        import urllib.parse
+        import urllib.request
+        source = urllib.request.url2pathname(urllib.parse.urlparse(source).path)
+    return cv2.VideoCapture(source)
+
+def detect_benchmark_command(args):
+    """Detection FPS of the legacy full-frame cascade call versus FaceDetector on the same frames."""
+    cap = open_source(args.source)
+    frames = []
+    while len(frames) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    cap.release()
+    if not frames:
+        print(f"Could not read frames from {args.source}")
+        return
+    
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    print(f"{len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+    for label, detector in (("legacy", FaceDetector.legacy(cascade)),
+                            ("downscaled+roi", FaceDetector(cascade, scale=args.scale))):
+        found = sum(len(detector.detect(gray)) for gray in frames)
+        print(f"{label:>15}: {detector.fps():7.1f} FPS, {found / len(frames):.2f} faces/frame")
+
+def batch_command(args):
+    """
+    Headless attendance over recorded videos, stream URLs and image directories. Inputs are
+    spread over a process pool; the parent is the only SQLite writer.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    start_time = datetime.strptime(args.start, '%Y-%m-%d %H:%M') if args.start else datetime.now()
+    workers = max(1, min(args.workers or os.cpu_count() or 1, len(args.sources)))
+    
+    # Trained once here and saved, so the workers only memory-map it
+    gallery = GalleryStore(os.path.join(args.database, "gallery"))
+    model_path = os.path.join(args.database, "lbph_model")
+    manifest_path = os.path.join(args.database, "model_manifest.json")
+    if not model_is_current(manifest_path, model_path, gallery):
+        print("Training the recognizer on the current gallery...")
+        save_model(train_from_gallery(gallery), model_path, manifest_path, gallery.signature())
+    print(f"Processing {len(args.sources)} input(s) with {workers} worker process(es)")
+    
+    conn = open_database(args.database, report=print)
+    cursor = conn.cursor()
+    directory = StudentDirectory.load(conn)
+    marked, already, unregistered, failed = set(), set(), set(), 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(args.database,)) as pool:
+        futures = [pool.submit(_process_batch_source, source, args.stride) for source in args.sources]
+        for future in as_completed(futures):
+            result = future.result()
+            if 'error' in result:
+                failed += 1
+                print(f"  {result['source']}: failed ({result['error']})")
+                continue
+            
+            # Names are recorded as each input finishes, at the time they were confirmed in it
+            for name, offset in sorted(result['seen'].items(), key=lambda item: item[1]):
+                timestamp = start_time + timedelta(seconds=offset)
+                student = directory.get(name)
+                if student is None:
+                    unregistered.add(name)
+                elif insert_attendance(cursor, student.student_id, timestamp):
+                    marked.add(name)
+                else:
+                    already.add(name)
+            conn.commit()
+            fps = result['frames'] / result['seconds'] if result['seconds'] else 0.0
+            print(f"  {result['source']}: {result['frames']} frames, {result['faces']} faces, "
+                  f"{len(result['seen'])} students, {fps:.1f} frames/s")
+    conn.close()
+    
+    print(f"Done in {time.perf_counter() - started:.1f}s: {len(marked)} marked, "
+          f"{len(already - marked)} already marked for the day, {failed} input(s) failed")
+    if marked:
+        print("Marked: " + ", ".join(sorted(marked)))
+    if unregistered:
+        print("Recognized but not registered in any class: " + ", ".join(sorted(unregistered)))
+
+def cameras_command(args):
+    """
+    Live attendance from several cameras or videos without the GUI. Each source runs in its own
+    worker process on the shared saved model; the parent merges their names and is the only
+    SQLite writer.
+    """
+    gallery = GalleryStore(os.path.join(args.database, "gallery"))
+    model_path = os.path.join(args.database, "lbph_model")
+    manifest_path = os.path.join(args.database, "model_manifest.json")
+    if not model_is_current(manifest_path, model_path, gallery):
+        print("Training the recognizer on the current gallery...")
+        save_model(train_from_gallery(gallery), model_path, manifest_path, gallery.signature())
+    
+    conn = open_database(args.database, report=print)
+    writer = AttendanceWriter(args.database)
+    directory = StudentDirectory.load(conn, gallery.label_map)
+    attendance = AttendanceStore(conn, writer)
+    marked = {entry['name'] for entry in attendance.today()}
+    
+    session_labels = None
+    if args.roster:
+        session_labels, unmatched = directory.roster_labels(read_roster(args.roster))
+        if unmatched:
+            print(f"{len(unmatched)} roster entries match no registered student")
+    elif args.faculty or args.year:
+        session_labels = directory.labels_for(args.faculty, args.year)
+    if session_labels is not None:
+        print(f"Session of {len(session_labels)} students; other faces are searched in the whole gallery")
+    cameras = MultiCameraAttendance(args.sources, model_path, gallery.id_map, marked, show=args.show,
+                                    session_labels=session_labels, target_fps=args.target_fps)
+    print(f"Watching {len(args.sources)} source(s); press Ctrl+C to stop")
+    
+    def record(events):
+        while not writer.errors.empty():
+            print(writer.errors.get_nowait())
+        for name, source, timestamp in events:
+            student = directory.get(name)
+            if student is None:
+                print(f"  {timestamp:%H:%M:%S} {name} ({source}): not registered in any class")
+                continue
+            attendance.add(name, timestamp)
+            writer.submit(student.student_id, timestamp)
+            print(f"  {timestamp:%H:%M:%S} {name} ({source})")
+    
+    cameras.start()
+    try:
+        while cameras.active():
+            record(cameras.poll(timeout=0.1))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cameras.stop()
+        record(cameras.poll())
+        writer.close()
+        record([])
+        conn.close()
+    
+    for source in cameras.sources:
+        frames, seconds = cameras.stats.get(source, (0, 0.0))
+        fps = frames / seconds if seconds else 0.0
+        print(f"{source}: {frames} frames, {fps:.1f} frames/s")
+    print(f"{len(cameras.reported - marked)} marked")
+
+def export_command(args):
+    """Stream attendance to a file, filtered by date range, faculty and year."""
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower() or 'csv'
+    conn = open_database(args.database, report=print)
+    started = time.perf_counter()
+    try:
+        rows = export_attendance_rows(conn, args.output, fmt, start=args.start, end=args.end,
+                                      faculty=args.faculty, year=args.year, chunk_size=args.chunk_size)
+    except (ValueError, RuntimeError) as e:
+        print(f"Export failed: {e}")
+        return
+    finally:
+        conn.close()
+    print(f"Exported {rows} rows to {args.output} in {time.perf_counter() - started:.1f}s")
+
+def report_command(args):
+    """Attendance report for any date range, e.g. a semester, written to an Excel workbook."""
+    conn = open_database(args.database, report=print)
+    started = time.perf_counter()
+    report = attendance_report(conn, args.start, args.end, args.faculty, args.year)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    write_report(report, args.output)
+    print(f"{len(report['Students'])} students, {int(report['Rollup']['Marks'].sum())} marks "
+          f"computed in {elapsed:.2f}s, written to {args.output}")
+    print(report['Rollup'].to_string(index=False))
+
 def main():
+    parser = argparse.ArgumentParser(description="Face Recognition Attendance System")
+    parser.add_argument('--database', default=DATABASE_DIR, help="student database directory")
+    parser.add_argument('--camera', nargs='+', default=["0"],
+                        help="camera indices, or video files to replay in place of cameras; several run side by side")
+    parser.add_argument('--metrics-port', type=int, help="serve stage latencies as Prometheus text on 127.0.0.1:<port>/metrics")
+    parser.add_argument('--metrics-file', help="rewrite this file with the Prometheus text every few seconds")
+    parser.add_argument('--capture-rate', type=float, default=AUTO_CAPTURE_RATE,
+                        help="samples per second taken by hands-free registration")
+    parser.add_argument('--target-fps', type=float, default=TARGET_FPS,
+                        help="attendance frame rate to hold by adapting detection and recognition (0 disables)")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="print 'window' once the main window is drawn and 'ready' once the models are loaded, then exit")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    import_parser = subparsers.add_parser('import-gallery', help="pack a photos/<name>/*.jpg tree into the gallery store")
+    import_parser.add_argument('--photos', help="photos directory (default: <database>/photos)")
+    import_parser.set_defaults(handler=import_gallery_command)
+    
+    prune_parser = subparsers.add_parser('prune', help="drop blurry, badly exposed and near-duplicate samples")
+    prune_parser.add_argument('--photos', help="prune a photos/<name>/*.jpg tree instead of the gallery store")
+    prune_parser.add_argument('--evaluate', type=int, default=200, metavar='QUERIES',
+                              help="held-out crops used to compare latency and accuracy (0 skips)")
+    prune_parser.add_argument('--seed', type=int, default=0)
+    prune_parser.add_argument('--dry-run', action='store_true', help="report without removing anything")
+    prune_parser.set_defaults(handler=prune_command)
+    
+    report_parser = subparsers.add_parser('search-report', help="compare the two-stage search with the exhaustive one")
+    report_parser.add_argument('--samples', type=int, default=200, help="number of query crops")
+    report_parser.add_argument('--top-k', type=int, nargs='+', default=[1, 5, 10, 20, 50])
+    report_parser.add_argument('--seed', type=int, default=0)
+    report_parser.set_defaults(handler=search_report_command)
+    
+    detect_parser = subparsers.add_parser('detect-benchmark', help="measure face detection FPS before/after")
+    detect_parser.add_argument('source', nargs='?', default='0', help="camera index or video file")
+    detect_parser.add_argument('--frames', type=int, default=300)
+    detect_parser.add_argument('--scale', type=float, default=DETECT_SCALE)
+    detect_parser.set_defaults(handler=detect_benchmark_command)
+    
+    batch_parser = subparsers.add_parser('batch', help="take attendance from recorded videos or image folders")
+    batch_parser.add_argument('sources', nargs='+', help="video files, file:// or rtsp:// URLs, or image directories")
+    batch_parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    batch_parser.add_argument('--stride', type=int, default=1, help="process every Nth video frame")
+    batch_parser.add_argument('--start', help="recording start as 'YYYY-MM-DD HH:MM' (default: now)")
+    batch_parser.set_defaults(handler=batch_command)
+    
+    cameras_parser = subparsers.add_parser('cameras', help="take attendance live from several cameras without the GUI")
+    cameras_parser.add_argument('sources', nargs='+', help="camera indices, video files or stream URLs")
+    cameras_parser.add_argument('--show', action='store_true', help="open a window per source")
+    cameras_parser.add_argument('--faculty', choices=FACULTIES, help="session faculty, searched first")
+    cameras_parser.add_argument('--year', type=int, choices=YEARS, help="session year, searched first")
+    cameras_parser.add_argument('--roster', help="file of the session's names or roll numbers, one per line")
+    cameras_parser.set_defaults(handler=cameras_command)
+    
+    export_parser = subparsers.add_parser('export', help="stream attendance records to CSV, Parquet or Feather")
+    export_parser.add_argument('output', help="output file; the format follows the extension unless --format is given")
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS)
+    export_parser.add_argument('--start', help="first date, YYYY-MM-DD")
+    export_parser.add_argument('--end', help="day after the last date, YYYY-MM-DD")
+    export_parser.add_argument('--faculty', choices=FACULTIES)
+    export_parser.add_argument('--year', type=int, choices=YEARS)
+    export_parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_ROWS)
+    export_parser.set_defaults(handler=export_command)
+    
+    attendance_report_parser = subparsers.add_parser('report', help="attendance percentages and presence matrix for a date range")
+    attendance_report_parser.add_argument('output', help="Excel workbook to write")
+    attendance_report_parser.add_argument('--start', required=True, help="first date, YYYY-MM-DD")
+    attendance_report_parser.add_argument('--end', required=True, help="day after the last date, YYYY-MM-DD")
+    attendance_report_parser.add_argument('--faculty', choices=FACULTIES)
+    attendance_report_parser.add_argument('--year', type=int, choices=YEARS)
+    attendance_report_parser.set_defaults(handler=report_command)
+    
+    args = parser.parse_args()
+    if args.command:
+        args.handler(args)
+        return
+    
     root = tk.Tk()
-    app = AttendanceSystemGUI(root)
+    app = AttendanceSystemGUI(root, args.camera, args.metrics_port, args.metrics_file, args.database,
+                              args.capture_rate, args.target_fps)
+    if args.startup_report:
+        # Used by benchmark.py to time a cold start from outside the process
+        root.update()
+        print("window", flush=True)
+        
+        def report_ready():
+            if app.trainer.busy() or not app.trainer.results.empty() or not app.cascade_loaded.is_set():
+                root.after(10, report_ready)
+                return
+            print("ready", flush=True)
+            app.on_close()
+        root.after(10, report_ready)
     root.mainloop()
 
 if __name__ == "__main__":